@@ -1,86 +1,156 @@
+import functools
+import itertools
 import os
+import re
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 
-def get_workflow_files():
-    """Get all YAML files in the .github/workflows directory."""
-    workflows_dir = '.github/workflows'
-    if not os.path.exists(workflows_dir):
-        return []
-    return [os.path.join(workflows_dir, f) for f in os.listdir(workflows_dir) if f.endswith('.yml')]
+# Prefer the libyaml-backed loader when PyYAML was built against libyaml.
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Workflows without a top-level 'jobs' key contribute no rows. The pre-scan errs towards
+# parsing: it accepts quoted keys ("jobs":, 'jobs':) and flow style ({..., jobs: ...}).
+_JOBS_RE = re.compile(rb'(?:^|[{,])\s*["\']?jobs["\']?\s*:', re.M)
+
+WORKFLOWS_DIR = '.github/workflows'
+
+@functools.lru_cache(maxsize=1)
+def get_workflow_files(workflows_dir=WORKFLOWS_DIR):
+    """Get all YAML files in the workflows directory.
+
+    The listing is cached per directory, so it is returned as a tuple.
+    """
+    try:
+        it = os.scandir(workflows_dir)
+    except FileNotFoundError:
+        return ()
+    with it:
+        return tuple(entry.path for entry in it
+                     if entry.name.endswith('.yml') and entry.is_file(follow_symlinks=False))
 
 def parse_workflow(file_path):
-    """Parse a workflow file."""
-    with open(file_path, 'r') as f:
-        return yaml.safe_load(f)
+    """Parse a workflow file, or return None without parsing if it has no top-level jobs."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if not _JOBS_RE.search(data):
+        return None
+    return yaml.load(data, Loader=_YAML_LOADER)
+
+def _try_parse_workflow(file_path):
+    """Parse a workflow file, returning (workflow, error) instead of raising on bad YAML."""
+    try:
+        return parse_workflow(file_path), None
+    except yaml.YAMLError as e:
+        return None, e
+
+def parse_workflows(file_paths):
+    """Parse workflow files concurrently, returning (file_path, workflow, error) in input order."""
+    file_paths = list(file_paths)
+    if not file_paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(file_paths))) as ex:
+        results = list(ex.map(_try_parse_workflow, file_paths))
+    return [(path, workflow, error) for path, (workflow, error) in zip(file_paths, results)]
+
+HEADER = (
+    "# Workflow Platform Truth Table\n\n"
+    "This table shows which architectures are built for each step in each workflow, based on the triggering event.\n\n"
+)
+
+# Trigger events reported in the table, in row order, with the ref they run on
+_EVENT_TABLE = (
+    ('push', 'refs/heads/master'),
+    ('pull_request', ''),
+    ('release', ''),
+    ('workflow_dispatch', ''),
+)
+
+# One markdown table row: workflow, job, step, event, amd64, arm64
+_ROW = "| `{0}` | `{1}` | `{2}` | {3} | {4} | {5} |\n".format
+
+# (amd64, arm64) glyphs per (event, ref); anything else builds for amd64 only.
+_EVENT_GLYPHS = {
+    ('workflow_dispatch', ''): ('✅', '✅'),  # Both are possible
+    ('release', ''): ('✅', '✅'),
+    ('push', 'refs/heads/master'): ('✅', '✅'),
+    ('pull_request', ''): ('✅', '❌'),
+    ('(called)', ''): ('✅', '❌'),
+}
+_DEFAULT_GLYPHS = ('✅', '❌')
 
 def get_platforms_for_event(event, ref):
-    """Determine the platforms for a given event."""
-    if event == 'workflow_dispatch':
-        return ['amd64', 'arm64']  # Both are possible
-    if event == 'release':
-        return ['amd64', 'arm64']
-    if event == 'push' and ref == 'refs/heads/master':
-        return ['amd64', 'arm64']
-    if event == 'pull_request':
-        return ['amd64']
-    return ['amd64'] # Default for other events
+    """Determine the (amd64, arm64) glyphs for a given event."""
+    return _EVENT_GLYPHS.get((event, ref), _DEFAULT_GLYPHS)
 
 def generate_truth_table(workflows):
-    """Generate the truth table."""
-    table = []
-    table.append("| Workflow | Job | Step | Event | amd64 | arm64 |")
-    table.append("|---|---|---|---|---|---|")
+    """Generate the truth table, yielding one newline-terminated row at a time."""
+    yield "| Workflow | Job | Step | Event | amd64 | arm64 |\n"
+    yield "|---|---|---|---|---|---|\n"
 
-    for file_path in workflows:
+    for file_path, workflow, error in parse_workflows(workflows):
+        if error is not None:
+            print(f"Error parsing {file_path}: {error}")
+            continue
         workflow_name = os.path.basename(file_path)
-        try:
-            workflow = parse_workflow(file_path)
-            if not workflow or 'jobs' not in workflow:
+        if not workflow or 'jobs' not in workflow:
+            continue
+
+        # Events (and therefore platforms) only depend on the workflow,
+        # so the per-event glyphs are resolved once and reused per step.
+        on = workflow.get('on') or {}
+        events = [(event, ref) for event, ref in _EVENT_TABLE if event in on]
+        if not events:
+            events.append(('(called)', ''))
+
+        event_glyphs = []
+        for event, ref in events:
+            if workflow_name == 'codeql.yml':
+                amd64 = arm64 = 'N/A'
+            else:
+                amd64, arm64 = get_platforms_for_event(event, ref)
+            event_glyphs.append((event, amd64, arm64))
+
+        for job_name, job in workflow.get('jobs', {}).items():
+            steps = job.get('steps', [])
+            if not steps:
                 continue
 
-            for job_name, job in workflow.get('jobs', {}).items():
-                steps = job.get('steps', [])
-                if not steps:
-                    continue
-
-                on = workflow.get('on', {})
-                events = []
-                if 'push' in on:
-                    events.append(('push', 'refs/heads/master'))
-                if 'pull_request' in on:
-                    events.append(('pull_request', ''))
-                if 'release' in on:
-                    events.append(('release', ''))
-                if 'workflow_dispatch' in on:
-                    events.append(('workflow_dispatch', ''))
-                if not events:
-                    events.append(('(called)', ''))
-
-
-                for step in steps:
-                    step_name = step.get('name', 'N/A')
-                    for event, ref in events:
-                        platforms = get_platforms_for_event(event, ref)
-                        amd64 = '✅' if 'amd64' in platforms else '❌'
-                        arm64 = '✅' if 'arm64' in platforms else '❌'
-                        if workflow_name == 'codeql.yml':
-                            amd64 = 'N/A'
-                            arm64 = 'N/A'
-                        table.append(f"| `{workflow_name}` | `{job_name}` | `{step_name}` | {event} | {amd64} | {arm64} |")
-        except yaml.YAMLError as e:
-            print(f"Error parsing {file_path}: {e}")
-
-
-    return "\n".join(table)
+            for step in steps:
+                step_name = step.get('name', 'N/A')
+                for event, amd64, arm64 in event_glyphs:
+                    yield _ROW(workflow_name, job_name, step_name, event, amd64, arm64)
+
+def write_atomically(path, chunks):
+    """Write chunks to path through a temp file in the same directory.
+
+    The temp file replaces path only once everything is written, so an error
+    partway through leaves the previous file untouched.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(chunks)
+        # mkstemp creates the file 0600; keep the mode a plain open() would have given it
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 def main():
     """Main function."""
     workflow_files = get_workflow_files()
-    truth_table = generate_truth_table(workflow_files)
-    with open('TESTS.md', 'w') as f:
-        f.write("# Workflow Platform Truth Table\n\n")
-        f.write("This table shows which architectures are built for each step in each workflow, based on the triggering event.\n\n")
-        f.write(truth_table)
+    write_atomically('TESTS.md', itertools.chain((HEADER,), generate_truth_table(workflow_files)))
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,7 @@
 import logging
 import queue
-import time
+import signal
+import threading
 import os
 from dotenv import load_dotenv
 
@@ -25,9 +26,30 @@ MQTT_QOS_DEFAULT = 2
 MQTT_KEEPALIVE_DEFAULT = 60  # seconds
 MQTT_USE_TLS_DEFAULT = True
 
+# Environment variables read by main(), with the default used when unset
+_ENV_DEFAULTS = (
+    ("MQTT_BROKER_HOST", MQTT_BROKER_HOST_DEFAULT),
+    ("MQTT_BROKER_PORT", MQTT_BROKER_PORT_DEFAULT),
+    ("MQTT_USERNAME", MQTT_USERNAME_DEFAULT),
+    ("MQTT_PASSWORD", MQTT_PASSWORD_DEFAULT),
+    ("MQTT_CLIENT_ID", MQTT_CLIENT_ID_DEFAULT),
+    ("MQTT_PRINT_TOPIC", MQTT_PRINT_TOPIC_DEFAULT),
+    ("MQTT_QOS", MQTT_QOS_DEFAULT),
+    ("MQTT_KEEPALIVE", MQTT_KEEPALIVE_DEFAULT),
+    ("MQTT_USE_TLS", str(MQTT_USE_TLS_DEFAULT)),
+)
+
 # --- Queues ---
-# Queue for messages from MQTT to serial (for printing)
-mqtt_to_serial_queue = queue.Queue()
+# Queue for messages from MQTT to serial (for printing). Nothing joins on it,
+# so the lighter C-implemented SimpleQueue (no task tracking) is enough.
+mqtt_to_serial_queue = queue.SimpleQueue()
+# Set by SIGINT/SIGTERM to make main() shut the daemon down
+shutdown_event = threading.Event()
+
+
+def request_shutdown(signum, frame):
+    """Signal handler that wakes main() so it can stop the handlers."""
+    shutdown_event.set()
 
 
 def setup_logging():
@@ -46,22 +68,22 @@ def main():
     logging.info("Starting Printer Daemon...")
 
     # Get MQTT config from environment variables or use defaults
-    broker_host = os.environ.get("MQTT_BROKER_HOST", MQTT_BROKER_HOST_DEFAULT)
-    broker_port = int(os.environ.get("MQTT_BROKER_PORT", MQTT_BROKER_PORT_DEFAULT))
-    username = os.environ.get("MQTT_USERNAME", MQTT_USERNAME_DEFAULT)
-    password = os.environ.get("MQTT_PASSWORD", MQTT_PASSWORD_DEFAULT)
-    client_id = os.environ.get("MQTT_CLIENT_ID", MQTT_CLIENT_ID_DEFAULT)
-    print_topic = os.environ.get("MQTT_PRINT_TOPIC", MQTT_PRINT_TOPIC_DEFAULT)
-    qos = int(os.environ.get("MQTT_QOS", MQTT_QOS_DEFAULT))
-    keepalive = int(os.environ.get("MQTT_KEEPALIVE", MQTT_KEEPALIVE_DEFAULT))
-    use_tls_str = os.environ.get("MQTT_USE_TLS", str(MQTT_USE_TLS_DEFAULT))
-    use_tls = use_tls_str.lower() in ("true", "1", "yes")
+    cfg = {name: os.environ.get(name, default) for name, default in _ENV_DEFAULTS}
+    broker_host = cfg["MQTT_BROKER_HOST"]
+    broker_port = int(cfg["MQTT_BROKER_PORT"])
+    username = cfg["MQTT_USERNAME"]
+    password = cfg["MQTT_PASSWORD"]
+    client_id = cfg["MQTT_CLIENT_ID"]
+    print_topic = cfg["MQTT_PRINT_TOPIC"]
+    qos = int(cfg["MQTT_QOS"])
+    keepalive = int(cfg["MQTT_KEEPALIVE"])
+    use_tls = cfg["MQTT_USE_TLS"].lower() in ("true", "1", "yes")
 
     logging.info(
-        f"MQTT Config: Host={broker_host}, Port={broker_port}, "
-        f"User={username}, TLS={use_tls}"
+        "MQTT Config: Host=%s, Port=%s, User=%s, TLS=%s",
+        broker_host, broker_port, username, use_tls,
     )
-    logging.info(f"MQTT Topics: PrintTopic={print_topic}, QoS={qos}")
+    logging.info("MQTT Topics: PrintTopic=%s, QoS=%s", print_topic, qos)
 
     serial_handler = PrinterSerialHandler(
         SERIAL_DEVICE_PATH,
@@ -82,15 +104,16 @@ def main():
         use_tls=use_tls,
     )
 
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
     serial_handler.start()
     mqtt_handler.start()
 
     try:
-        while True:
-            # Keep main thread alive, or implement other logic
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logging.info("KeyboardInterrupt received. Shutting down...")
+        # Sleep without periodic wakeups until a shutdown signal arrives
+        shutdown_event.wait()
+        logging.info("Shutdown signal received. Shutting down...")
     finally:
         logging.info("Stopping threads...")
         if mqtt_handler.is_alive():
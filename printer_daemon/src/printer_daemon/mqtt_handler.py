@@ -1,15 +1,21 @@
 import logging
 import threading
-import time
 import paho.mqtt.client as mqtt # type: ignore
+import socket
 import ssl
 import queue
 
+logger = logging.getLogger(__name__)
+
+# Maps every non-ASCII byte to b'?', matching what decode('ascii', errors='replace')
+# followed by encode('ascii', errors='replace') would print. Only used off the ASCII fast path.
+_ASCII_PRINTABLE = bytes(range(128)) + b'?' * 128
+
 class PrinterMqttHandler(threading.Thread):
     def __init__(self, broker_host, port, username, password, client_id,
                  print_topic, qos, keepalive,
-                 mqtt_to_serial_queue: queue.Queue, use_tls: bool = True):
-        super().__init__(name="PrinterMqttHandlerThread")
+                 mqtt_to_serial_queue: queue.SimpleQueue, use_tls: bool = True):
+        super().__init__(name="PrinterMqttHandlerThread", daemon=True)
         self.broker_host = broker_host
         self.port = port
         self.username = username
@@ -20,122 +26,127 @@ class PrinterMqttHandler(threading.Thread):
         self.keepalive = keepalive
         self.mqtt_to_serial_queue = mqtt_to_serial_queue # Messages to PrinterSerialHandler
         self.use_tls = use_tls
+        # Built once so client rebuilds don't reload the system CA store each time
+        self._ssl_ctx = ssl.create_default_context() if use_tls else None
         self.running = False
         self.client: mqtt.Client | None = None
         self.connection_rc = -1 # To store connection result code
-        self.reconnect_delay = 5  # seconds
+        self.connected_event = threading.Event() # Set while connected to the broker
+        self._stop_event = threading.Event() # Set by stop() to end run()
+        self.reconnect_delay = 5  # seconds, upper bound of paho's reconnect backoff
 
-        logging.info(f"PrinterMqttHandler initialized for broker {self.broker_host}:{self.port} (TLS: {self.use_tls}).")
+        logger.info("PrinterMqttHandler initialized for broker %s:%s (TLS: %s).", self.broker_host, self.port, self.use_tls)
 
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         self.connection_rc = rc
+        if self._stop_event.is_set():
+            client.disconnect() # stop() raced with a reconnect that has just completed
+            return
         if rc == 0:
-            logging.info(f"Successfully connected to MQTT broker {self.broker_host}:{self.port}. Subscribing...")
+            self.connected_event.set()
+            logger.info("Successfully connected to MQTT broker %s:%s. Subscribing...", self.broker_host, self.port)
             client.subscribe(self.print_topic, qos=self.qos)
-            logging.info(f"Subscribed to {self.print_topic} with QoS {self.qos}.")
+            logger.info("Subscribed to %s with QoS %s.", self.print_topic, self.qos)
         else:
-            logging.error(f"Failed to connect to MQTT broker: {mqtt.connack_string(rc)}")
+            logger.error("Failed to connect to MQTT broker: %s", mqtt.connack_string(rc))
 
     def _on_disconnect(self, client, userdata, flags, reasoncode, properties=None):
+        self.connected_event.clear()
         if isinstance(reasoncode, int): # For older paho-mqtt or v1 style rc
-            logging.warning(f"Disconnected from MQTT broker: {mqtt.connack_string(reasoncode)}. Will attempt to reconnect.")
+            logger.warning("Disconnected from MQTT broker: %s. Will attempt to reconnect.", mqtt.connack_string(reasoncode))
         else: # For paho-mqtt v2 ReasonCode object
-            logging.warning(f"Disconnected from MQTT broker: {reasoncode}. Will attempt to reconnect.")
+            logger.warning("Disconnected from MQTT broker: %s. Will attempt to reconnect.", reasoncode)
+
+    def _on_socket_open(self, client, userdata, sock):
+        # Runs before CONNECT goes out. The QoS 2 replies (PUBREC, PUBCOMP) are a few bytes
+        # each, and with Nagle on they can sit behind the broker's delayed ACK.
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.warning("Could not disable Nagle on the MQTT socket: %s", e)
+
+    def _on_connect_fail(self, client, userdata):
+        if self._stop_event.is_set():
+            client.disconnect() # Don't start another backoff wait while shutting down
+            return
+        logger.error("Printer MQTT connection to %s:%s failed. Retrying with backoff.", self.broker_host, self.port)
 
     def _on_message(self, client, userdata, msg: mqtt.MQTTMessage):
         try:
-            logging.info(f"Received MQTT message on topic '{msg.topic}': {len(msg.payload)} bytes")
+            logger.debug("Received MQTT message on topic '%s': %s bytes", msg.topic, len(msg.payload))
             if msg.topic == self.print_topic:
                 if msg.payload:
-                    try:
-                        # The printer expects ASCII text. The scale already provides this.
-                        # The serial handler will add LF.
-                        message_str = msg.payload.decode('ascii', errors='replace')
-                        self.mqtt_to_serial_queue.put(message_str)
-                        logging.info(f"Message from '{msg.topic}' put to mqtt_to_serial_queue for printing.")
-                    except UnicodeDecodeError as ude:
-                        logging.error(f"Could not decode MQTT payload from {msg.topic} as ASCII: {ude}. Payload: {msg.payload!r}")
+                    # The printer expects LF-terminated ASCII. The scale already provides
+                    # ASCII, so queue the ready-to-write bytes and skip a str round-trip.
+                    payload = bytes(msg.payload)
+                    if not payload.isascii():
+                        logger.warning("Non-ASCII bytes in payload from %s, replacing with '?': %r", msg.topic, payload)
+                        payload = payload.translate(_ASCII_PRINTABLE)
+                    payload += b'\n'
+                    self.mqtt_to_serial_queue.put(payload)
+                    logger.debug("Message from '%s' put to mqtt_to_serial_queue for printing.", msg.topic)
                 else:
-                    logging.warning(f"Received empty payload on print topic {self.print_topic}.")
+                    logger.warning("Received empty payload on print topic %s.", self.print_topic)
             else:
-                logging.warning(f"Received message on unexpected topic: {msg.topic}")
+                logger.warning("Received message on unexpected topic: %s", msg.topic)
         except Exception as e:
-            logging.error(f"Error processing MQTT message for printer: {e}")
+            logger.error("Error processing MQTT message for printer: %s", e)
 
     def _setup_client(self):
         try:
             self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id)
             self.client.username_pw_set(self.username, self.password)
             if self.use_tls:
-                logging.info("Configuring MQTT client with TLS for printer.")
-                self.client.tls_set(
-                    cert_reqs=ssl.CERT_REQUIRED,
-                    tls_version=ssl.PROTOCOL_TLS_CLIENT,
-                )
+                logger.info("Configuring MQTT client with TLS for printer.")
+                # Default context: CERT_REQUIRED, hostname checks, system CAs, highest TLS version
+                self.client.tls_set_context(self._ssl_ctx)
             else:
-                logging.info("Configuring MQTT client without TLS for printer.")
+                logger.info("Configuring MQTT client without TLS for printer.")
+            # paho's network loop reconnects on its own, backing off from 1s up to reconnect_delay
+            self.client.reconnect_delay_set(min_delay=1, max_delay=self.reconnect_delay)
             self.client.on_connect = self._on_connect
+            self.client.on_connect_fail = self._on_connect_fail
+            self.client.on_socket_open = self._on_socket_open
             self.client.on_disconnect = self._on_disconnect
             self.client.on_message = self._on_message
             return True
         except Exception as e:
-            logging.error(f"Error setting up MQTT client for printer: {e}")
+            logger.error("Error setting up MQTT client for printer: %s", e)
             self.client = None
             return False
 
     def run(self):
         self.running = True
-        logging.info("PrinterMqttHandler thread started.")
+        logger.info("PrinterMqttHandler thread started.")
 
         if not self._setup_client() or not self.client:
-            logging.error("Printer MQTT client setup failed. Thread cannot start.")
+            logger.error("Printer MQTT client setup failed. Thread cannot start.")
             self.running = False
             return
 
-        while self.running:
-            if not self.client.is_connected():
-                try:
-                    logging.info(f"Attempting to connect to MQTT broker {self.broker_host}:{self.port} for printer...")
-                    self.connection_rc = -1
-                    self.client.connect(self.broker_host, self.port, self.keepalive)
-                    self.client.loop_start()
-
-                    connect_timeout = time.time() + 10
-                    while self.connection_rc == -1 and time.time() < connect_timeout and self.running:
-                        time.sleep(0.1)
-
-                    if self.connection_rc != 0 and self.running:
-                        logging.error(f"Printer MQTT connection failed. Will retry in {self.reconnect_delay}s.")
-                        self.client.loop_stop()
-                        time.sleep(self.reconnect_delay)
-                        continue
-                    elif not self.running:
-                        break
-                except ConnectionRefusedError:
-                    logging.error(f"Printer MQTT ConnectionRefusedError. Retrying in {self.reconnect_delay}s.")
-                    time.sleep(self.reconnect_delay)
-                    continue
-                except Exception as e:
-                    logging.error(f"Error connecting printer MQTT client: {e}. Retrying in {self.reconnect_delay}s.")
-                    if self.client.is_connected():
-                        self.client.loop_stop()
-                    time.sleep(self.reconnect_delay)
-                    continue
-
-            # Unlike scale, printer MQTT handler is mostly reactive (receives messages).
-            # The loop_start() handles receiving messages in its own thread.
-            # We just need to keep this thread alive and check `self.running`.
-            time.sleep(0.1) # Keep alive, check running flag
+        try:
+            logger.info("Connecting to MQTT broker %s:%s for printer...", self.broker_host, self.port)
+            self.client.connect_async(self.broker_host, self.port, self.keepalive)
+        except Exception as e:
+            logger.error("Error starting printer MQTT client: %s", e)
+            self.running = False
+            return
 
-        if self.client:
-            if self.client.is_connected():
-                logging.info("Disconnecting printer MQTT client...")
-                self.client.loop_stop()
-                self.client.disconnect()
-            else:
-                self.client.loop_stop(force=True)
-        logging.info("PrinterMqttHandler thread stopped.")
+        # The printer MQTT handler is purely reactive, so this thread runs paho's
+        # network loop itself instead of idling while loop_start() adds another thread.
+        # loop_forever() connects, reconnects with backoff and returns after disconnect().
+        if not self._stop_event.is_set():
+            try:
+                self.client.loop_forever(retry_first_connection=True)
+            except Exception as e:
+                logger.error("Error in printer MQTT network loop: %s", e)
+        logger.info("PrinterMqttHandler thread stopped.")
 
     def stop(self):
         self.running = False
-        logging.info("Stopping PrinterMqttHandler thread...")
+        self._stop_event.set()
+        logger.info("Stopping PrinterMqttHandler thread...")
+        if self.client:
+            if self.connected_event.is_set():
+                logger.info("Disconnecting printer MQTT client...")
+            self.client.disconnect() # Makes loop_forever() return, also from a reconnect wait
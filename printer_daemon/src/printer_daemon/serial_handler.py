@@ -1,40 +1,49 @@
 import logging
+import random
 import threading
-import time
 import serial # type: ignore
 import os
 import queue
 
+logger = logging.getLogger(__name__)
+
+# Put on the queue by stop() to wake a run loop blocked in queue.get().
+_SENTINEL = object()
+
 class PrinterSerialHandler(threading.Thread):
-    def __init__(self, device_path, baudrate, timeout, mqtt_to_serial_queue: queue.Queue):
-        super().__init__(name="PrinterSerialHandlerThread")
+    def __init__(self, device_path, baudrate, timeout, mqtt_to_serial_queue: queue.SimpleQueue):
+        super().__init__(name="PrinterSerialHandlerThread", daemon=True)
         self.device_path = device_path
         self.baudrate = baudrate
         self.timeout = timeout # Write timeout
-        self.mqtt_to_serial_queue = mqtt_to_serial_queue # Messages from MQTT to print
-        self.running = False
+        self.mqtt_to_serial_queue = mqtt_to_serial_queue # LF-terminated ASCII payloads from MQTT to print
         self.ser: serial.Serial | None = None
-        self.reconnect_delay = 5  # seconds
+        self.reconnect_delay = 1  # seconds, base of the jittered reconnect backoff
+        self.max_reconnect_delay = 60  # seconds
+        self._backoff = self.reconnect_delay
+        self.queue_poll_timeout = 0.5  # seconds, bounds how long run() blocks on an idle queue
+        self.max_batch_messages = 16  # Queued messages coalesced into a single write
+        self.max_batch_bytes = 8192
+        self._pending: list[bytes] = []  # A batch whose write failed, retried before the queue
+        self._stop_event = threading.Event() # Set by stop(); run() loops until then
+        self.processed_event = threading.Event()  # Set after each successful write, mainly for tests
         self.mock_mode = os.getenv("MOCK_SERIAL_DEVICES") == "true"
 
         if self.mock_mode:
-            logging.info(
-                f"PrinterSerialHandler initialized in MOCK MODE for {self.device_path}."
+            logger.info(
+                "PrinterSerialHandler initialized in MOCK MODE for %s.", self.device_path
             )
         else:
-            logging.info(
-                f"PrinterSerialHandler initialized for {self.device_path} at {self.baudrate} baud."
+            logger.info(
+                "PrinterSerialHandler initialized for %s at %s baud.", self.device_path, self.baudrate
             )
 
     def _connect_serial(self):
         """Attempts to connect to the serial port or simulates connection in mock mode."""
         if self.mock_mode:
-            logging.info(f"MOCK MODE: Simulating successful connection to printer {self.device_path}.")
+            logger.info("MOCK MODE: Simulating successful connection to printer %s.", self.device_path)
             return True
 
-        if not os.path.exists(self.device_path):
-            logging.warning(f"Serial device {self.device_path} not found. Will retry in {self.reconnect_delay}s.")
-            return False
         try:
             self.ser = serial.Serial(
                 self.device_path,
@@ -48,14 +57,19 @@ class PrinterSerialHandler(threading.Thread):
             # For some printers, DTR/RTS might need to be managed if flow control is an issue
             # self.ser.dtr = True
             # self.ser.rts = True
-            logging.info(f"Successfully connected to printer serial port {self.device_path}.")
+            logger.info("Successfully connected to printer serial port %s.", self.device_path)
+            self._backoff = self.reconnect_delay
             return True
-        except serial.SerialException as e:
-            logging.error(f"Failed to connect to printer {self.device_path}: {e}. Will retry.")
+        except (serial.SerialException, OSError) as e:
             self.ser = None
+            # Only stat the path after a failed open, so the usual case costs no extra syscall
+            if not os.path.exists(self.device_path):
+                logger.warning("Serial device %s not found. Will retry with backoff.", self.device_path)
+            else:
+                logger.error("Failed to connect to printer %s: %s. Will retry.", self.device_path, e)
             return False
         except Exception as e: # Catch other potential errors like permission denied
-            logging.error(f"An unexpected error occurred connecting to printer {self.device_path}: {e}. Will retry.")
+            logger.error("An unexpected error occurred connecting to printer %s: %s. Will retry.", self.device_path, e)
             self.ser = None
             return False
 
@@ -63,7 +77,7 @@ class PrinterSerialHandler(threading.Thread):
     def _disconnect_serial(self):
         """Disconnects the serial port if connected or simulates in mock mode."""
         if self.mock_mode:
-            logging.info(f"MOCK MODE: Simulating disconnection from printer {self.device_path}.")
+            logger.info("MOCK MODE: Simulating disconnection from printer %s.", self.device_path)
             self.ser = None
             return
 
@@ -73,81 +87,136 @@ class PrinterSerialHandler(threading.Thread):
                 # for many printers, just closing is fine.
                 # self.ser.flush()
                 self.ser.close()
-                logging.info(f"Closed printer serial port {self.device_path}.")
+                logger.info("Closed printer serial port %s.", self.device_path)
             except Exception as e:
-                logging.error(f"Error closing printer serial port {self.device_path}: {e}")
+                logger.error("Error closing printer serial port %s: %s", self.device_path, e)
         self.ser = None
 
+    def _wait_before_reconnect(self):
+        """Sleeps for a decorrelated-jitter backoff: min(cap, uniform(base, 3 * previous))."""
+        self._backoff = min(self.max_reconnect_delay,
+                            random.uniform(self.reconnect_delay, self._backoff * 3))
+        logger.debug("Retrying printer %s in %.1fs.", self.device_path, self._backoff)
+        self._stop_event.wait(self._backoff) # Returns early if stop() is called
+
+    @property
+    def running(self):
+        """True between start() and stop(); kept for callers that used the old flag."""
+        return self.is_alive() and not self._stop_event.is_set()
+
     def run(self):
-        self.running = True
-        logging.info("PrinterSerialHandler thread started.")
+        logger.info("PrinterSerialHandler thread started.")
 
-        while self.running:
+        while not self._stop_event.is_set():
             if self.mock_mode:
                 # --- MOCK MODE ---
-                if not self.mqtt_to_serial_queue.empty():
-                    message_to_print: str = self.mqtt_to_serial_queue.get()
-                    logging.info(f"MOCK MODE: Received message for printer: '{message_to_print}' (not sent to device)")
-                    self.mqtt_to_serial_queue.task_done()
-
-                time.sleep(0.1)
+                try:
+                    message_to_print = self.mqtt_to_serial_queue.get(timeout=self.queue_poll_timeout)
+                except queue.Empty:
+                    continue
+                if message_to_print is not _SENTINEL:
+                    logger.info("MOCK MODE: Received message for printer: %r (not sent to device)", message_to_print)
                 continue # Skip real serial logic
 
             # --- NON-MOCK MODE (original logic mostly from here) ---
             if self.ser is None or not self.ser.is_open:
                 self._disconnect_serial()
                 if not self._connect_serial():
-                    time.sleep(self.reconnect_delay)
+                    self._wait_before_reconnect()
                     continue
 
             try:
-                if not self.mqtt_to_serial_queue.empty():
-                    message_to_print: str = self.mqtt_to_serial_queue.get()
-                    # Ensure self.ser is valid before using
-                    if self.ser and self.ser.is_open:
-                        try:
-                            # Ensure message is bytes and add LF
-                            payload = message_to_print.encode('ascii', errors='replace') + b'\n'
-                            logging.info(f"Printing to {self.device_path}: {payload!r}")
-                            self.ser.write(payload)
-                            # self.ser.flush() # Ensure data is sent, might be needed for some devices/drivers
-                            self.mqtt_to_serial_queue.task_done()
-                        except serial.SerialTimeoutException:
-                            logging.error(f"Write timeout to {self.device_path}. Re-queuing message.")
-                            self.mqtt_to_serial_queue.put(message_to_print) # Re-queue
-                            self._disconnect_serial() # Assume port issue, force reconnect
-                        except serial.SerialException as se_write:
-                            logging.error(f"SerialException during write to {self.device_path}: {se_write}. Re-queuing.")
-                            self.mqtt_to_serial_queue.put(message_to_print) # Re-queue
-                            self._disconnect_serial() # Assume port issue
-                        except OSError as ose_write:
-                            logging.error(f"OSError during write to {self.device_path} (device likely disconnected): {ose_write}. Re-queuing.")
-                            self.mqtt_to_serial_queue.put(message_to_print) # Re-queue
-                            self._disconnect_serial() # Assume port issue
-                    else:
-                        # Port not open, re-queue message
-                        logging.warning("Serial port not open while trying to print. Re-queuing message.")
-                        self.mqtt_to_serial_queue.put(message_to_print)
-                        self._disconnect_serial() # Force reconnect attempt
+                if self._pending:
+                    # Retry a failed batch before anything queued after it
+                    batch, self._pending = self._pending, []
                 else:
-                    # No message in queue, sleep briefly
-                    time.sleep(0.05) # Check queue periodically
+                    # Block until a message arrives; the timeout lets the loop re-check the stop event
+                    try:
+                        message_to_print = self.mqtt_to_serial_queue.get(timeout=self.queue_poll_timeout)
+                    except queue.Empty:
+                        continue
+                    if message_to_print is _SENTINEL:
+                        continue
+                    batch = self._collect_batch(message_to_print)
+                # Ensure self.ser is valid before using
+                if self.ser and self.ser.is_open:
+                    try:
+                        # Payloads are already ASCII bytes with the trailing LF
+                        payload = b"".join(batch)
+                        logger.info("Printing to %s: %r", self.device_path, payload)
+                        # pyserial passes bytes through to os.write(), which releases the GIL
+                        # while the port drains, so the MQTT network thread keeps running.
+                        self.ser.write(payload)
+                        self.processed_event.set()
+                        # self.ser.flush() # Ensure data is sent, might be needed for some devices/drivers
+                    except serial.SerialTimeoutException:
+                        logger.error("Write timeout to %s. Re-queuing message.", self.device_path)
+                        self._requeue(batch)
+                        self._disconnect_serial() # Assume port issue, force reconnect
+                    except serial.SerialException as se_write:
+                        logger.error("SerialException during write to %s: %s. Re-queuing.", self.device_path, se_write)
+                        self._requeue(batch)
+                        self._disconnect_serial() # Assume port issue
+                    except OSError as ose_write:
+                        logger.error("OSError during write to %s (device likely disconnected): %s. Re-queuing.", self.device_path, ose_write)
+                        self._requeue(batch)
+                        self._disconnect_serial() # Assume port issue
+                else:
+                    # Port not open, re-queue message
+                    logger.warning("Serial port not open while trying to print. Re-queuing message.")
+                    self._requeue(batch)
+                    self._disconnect_serial() # Force reconnect attempt
 
             except serial.SerialException as e: # Catch exceptions during ser.is_open or other ser ops
-                logging.error(f"SerialException in PrinterSerialHandler: {e}. Attempting to reconnect.")
+                logger.error("SerialException in PrinterSerialHandler: %s. Attempting to reconnect.", e)
                 self._disconnect_serial()
-                time.sleep(self.reconnect_delay)
+                self._wait_before_reconnect()
             except OSError as e:
-                 logging.error(f"OSError in PrinterSerialHandler (device likely disconnected): {e}. Attempting to reconnect.")
+                 logger.error("OSError in PrinterSerialHandler (device likely disconnected): %s. Attempting to reconnect.", e)
                  self._disconnect_serial()
-                 time.sleep(self.reconnect_delay)
+                 self._wait_before_reconnect()
             except Exception as e:
-                logging.error(f"Unexpected error in PrinterSerialHandler: {e}")
-                time.sleep(1) # Prevent rapid looping
+                logger.error("Unexpected error in PrinterSerialHandler: %s", e)
+                self._stop_event.wait(1) # Prevent rapid looping
 
         self._disconnect_serial()
-        logging.info("PrinterSerialHandler thread stopped.")
+        self._restore_queue()
+        logger.info("PrinterSerialHandler thread stopped.")
+
+    def _collect_batch(self, first):
+        """Drains messages already waiting behind `first` so they go out in one write."""
+        batch = [first]
+        size = len(first)
+        while len(batch) < self.max_batch_messages and size < self.max_batch_bytes:
+            try:
+                message = self.mqtt_to_serial_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is _SENTINEL:
+                break
+            batch.append(message)
+            size += len(message)
+        return batch
+
+    def _requeue(self, batch):
+        """Holds a batch whose write failed so run() prints it again ahead of newer messages."""
+        self._pending = batch
+
+    def _restore_queue(self):
+        """On exit, puts an unprinted batch back at the head of the queue and drops the stop() wake-up marker."""
+        pending, self._pending = self._pending, []
+        while True:
+            try:
+                item = self.mqtt_to_serial_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _SENTINEL:
+                pending.append(item)
+        for item in pending:
+            self.mqtt_to_serial_queue.put(item)
 
     def stop(self):
-        self.running = False
-        logging.info("Stopping PrinterSerialHandler thread...")
+        self._stop_event.set() # Also wakes run() from a backoff wait
+        # Wake run() immediately instead of waiting for the queue poll timeout
+        self.mqtt_to_serial_queue.put(_SENTINEL)
+        logger.info("Stopping PrinterSerialHandler thread...")
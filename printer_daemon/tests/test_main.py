@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import logging
+import signal
 
 from printer_daemon import main as printer_main
 
@@ -17,9 +18,10 @@ class TestPrinterMain(unittest.TestCase):
     @patch('printer_daemon.main.PrinterSerialHandler')
     @patch('printer_daemon.main.PrinterMqttHandler')
     @patch('printer_daemon.main.setup_logging')
-    @patch('time.sleep', side_effect=KeyboardInterrupt) # To break the main loop
+    @patch('printer_daemon.main.shutdown_event') # wait() returns at once, as if signalled
+    @patch('signal.signal')
     def test_main_starts_and_stops_handlers(
-            self, mock_time_sleep, mock_setup_logging,
+            self, mock_signal, mock_shutdown_event, mock_setup_logging,
             MockMqttHandler, MockSerialHandler):
 
         mock_serial_instance = MagicMock()
@@ -30,12 +32,12 @@ class TestPrinterMain(unittest.TestCase):
         MockMqttHandler.return_value = mock_mqtt_instance
         mock_mqtt_instance.is_alive.return_value = True
 
-        try:
-            printer_main.main()
-        except KeyboardInterrupt:
-            pass # Expected
+        printer_main.main()
 
         mock_setup_logging.assert_called_once()
+        mock_signal.assert_any_call(signal.SIGINT, printer_main.request_shutdown)
+        mock_signal.assert_any_call(signal.SIGTERM, printer_main.request_shutdown)
+        mock_shutdown_event.wait.assert_called_once_with()
 
         MockSerialHandler.assert_called_once_with(
             printer_main.SERIAL_DEVICE_PATH,
@@ -68,5 +70,11 @@ class TestPrinterMain(unittest.TestCase):
         mock_serial_instance.stop.assert_called_once()
         mock_serial_instance.join.assert_called_once()
 
+    def test_request_shutdown_sets_event(self):
+        printer_main.shutdown_event.clear()
+        printer_main.request_shutdown(signal.SIGTERM, None)
+        self.assertTrue(printer_main.shutdown_event.is_set())
+        printer_main.shutdown_event.clear()
+
 if __name__ == '__main__':
     unittest.main()
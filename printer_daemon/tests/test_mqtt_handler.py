@@ -1,7 +1,8 @@
 import unittest
 from unittest.mock import patch, MagicMock, ANY
 import queue
-import time
+import threading
+import socket
 import ssl
 
 from printer_daemon.mqtt_handler import PrinterMqttHandler
@@ -19,20 +20,30 @@ MOCK_KEEPALIVE = 60
 
 class TestPrinterMqttHandler(unittest.TestCase):
 
-    def setUp(self):
-        self.mqtt_to_serial_queue = queue.Queue() # Messages to serial handler for printing
+    @classmethod
+    def setUpClass(cls):
+        # Introspect the real Client once; every test's mock reuses the attribute list
+        cls.client_spec = dir(paho_mqtt.Client)
 
-        # Get the original class before it's patched
-        original_client_class = paho_mqtt.Client
+    def setUp(self):
+        self.mqtt_to_serial_queue = queue.SimpleQueue() # Messages to serial handler for printing
 
         self.patcher_mqtt_client = patch('paho.mqtt.client.Client')
         self.mock_mqtt_client_class = self.patcher_mqtt_client.start() # This is the mock for the CLASS
 
-        # Create an instance mock, specced against the original class
-        self.mock_client_instance = MagicMock(spec=original_client_class)
+        # Create an instance mock, specced against the real Client's attributes
+        self.mock_client_instance = MagicMock(spec=self.client_spec)
         self.mock_client_instance.is_connected.return_value = False
         # Make the class mock return our instance mock
         self.mock_mqtt_client_class.return_value = self.mock_client_instance
+        # Like paho's loop_forever(), block the handler thread until disconnect() is called
+        self.loop_entered = threading.Event()
+        self.loop_exited = threading.Event()
+        def loop_forever(*args, **kwargs):
+            self.loop_entered.set()
+            self.loop_exited.wait(1)
+        self.mock_client_instance.loop_forever.side_effect = loop_forever
+        self.mock_client_instance.disconnect.side_effect = lambda *a, **k: self.loop_exited.set()
 
         self.handler = PrinterMqttHandler(
             MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_USERNAME, MOCK_PASSWORD,
@@ -50,25 +61,58 @@ class TestPrinterMqttHandler(unittest.TestCase):
     def test_initialization(self):
         self.assertEqual(self.handler.print_topic, MOCK_PRINT_TOPIC)
         self.assertFalse(self.handler.running)
+        self.assertTrue(self.handler.daemon)
 
     @patch('time.sleep', MagicMock())
     def test_setup_client_success(self):
         self.assertTrue(self.handler._setup_client())
         self.mock_mqtt_client_class.assert_called_once_with(paho_mqtt.CallbackAPIVersion.VERSION2, client_id=MOCK_CLIENT_ID)
         self.mock_client_instance.username_pw_set.assert_called_once_with(MOCK_USERNAME, MOCK_PASSWORD)
-        self.mock_client_instance.tls_set.assert_called_once_with(
-            cert_reqs=ssl.CERT_REQUIRED,
-            tls_version=ssl.PROTOCOL_TLS_CLIENT
-        )
+        self.mock_client_instance.tls_set_context.assert_called_once_with(self.handler._ssl_ctx)
+        self.assertEqual(self.handler._ssl_ctx.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(self.handler._ssl_ctx.check_hostname)
         self.assertIsNotNone(self.handler.client.on_connect)
         self.assertIsNotNone(self.handler.client.on_message)
 
+    def test_setup_client_reuses_ssl_context(self):
+        self.handler._setup_client()
+        self.handler._setup_client()
+        contexts = [c.args[0] for c in self.mock_client_instance.tls_set_context.call_args_list]
+        self.assertEqual(len(contexts), 2)
+        self.assertIs(contexts[0], contexts[1])
+
+    def test_socket_open_disables_nagle(self):
+        self.handler._setup_client()
+        self.assertEqual(self.handler.client.on_socket_open, self.handler._on_socket_open)
+        mock_sock = MagicMock()
+        self.handler._on_socket_open(self.mock_client_instance, None, mock_sock)
+        mock_sock.setsockopt.assert_called_once_with(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def test_setup_client_without_tls(self):
+        handler = PrinterMqttHandler(
+            MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_USERNAME, MOCK_PASSWORD,
+            MOCK_CLIENT_ID, MOCK_PRINT_TOPIC, MOCK_QOS,
+            MOCK_KEEPALIVE, self.mqtt_to_serial_queue, use_tls=False
+        )
+        self.assertIsNone(handler._ssl_ctx)
+        self.assertTrue(handler._setup_client())
+        self.mock_client_instance.tls_set_context.assert_not_called()
+
     def test_on_connect_success_subscribes_to_print_topic(self):
         self.handler._setup_client()
         self.handler._on_connect(self.mock_client_instance, None, None, 0) # rc=0
         self.mock_client_instance.subscribe.assert_called_once_with(MOCK_PRINT_TOPIC, qos=MOCK_QOS)
         self.assertEqual(self.handler.connection_rc, 0)
 
+    def test_connected_event_tracks_connection_state(self):
+        self.handler._setup_client()
+        self.handler._on_connect(self.mock_client_instance, None, None, 5) # Refused
+        self.assertFalse(self.handler.connected_event.is_set())
+        self.handler._on_connect(self.mock_client_instance, None, None, 0)
+        self.assertTrue(self.handler.connected_event.is_set())
+        self.handler._on_disconnect(self.mock_client_instance, None, None, 7)
+        self.assertFalse(self.handler.connected_event.is_set())
+
     def test_on_message_puts_to_queue(self):
         self.handler._setup_client()
         mock_msg = MagicMock(spec=paho_mqtt.MQTTMessage)
@@ -76,7 +120,7 @@ class TestPrinterMqttHandler(unittest.TestCase):
         mock_msg.payload = b'Print this text'
 
         self.handler._on_message(self.mock_client_instance, None, mock_msg)
-        self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), 'Print this text')
+        self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), b'Print this text\n')
 
     def test_on_message_handles_decode_error(self):
         self.handler._setup_client()
@@ -85,8 +129,8 @@ class TestPrinterMqttHandler(unittest.TestCase):
         mock_msg.payload = b'\xff\xfe' # Invalid UTF-8/ASCII start
 
         self.handler._on_message(self.mock_client_instance, None, mock_msg)
-        # Should put replaced string
-        self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), '\ufffd\ufffd') # Replacement char
+        # Should put replaced bytes, as the printer would have received before
+        self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), b'??\n') # Replacement char
 
     def test_on_message_empty_payload(self):
         self.handler._setup_client()
@@ -98,47 +142,52 @@ class TestPrinterMqttHandler(unittest.TestCase):
         self.assertTrue(self.mqtt_to_serial_queue.empty()) # Should not queue empty messages
 
     def test_run_connects_and_subscribes_main_loop(self):
-        # is_connected will be called once before connect, should return False.
-        self.mock_client_instance.is_connected.side_effect = [False]
-
-        def mock_connect(*args, **kwargs):
+        # paho's network loop, run in the handler thread, connects and then calls _on_connect
+        def mock_loop_forever(*args, **kwargs):
             self.handler._on_connect(self.mock_client_instance, None, None, 0)
             self.mock_client_instance.is_connected.return_value = True
-            # Clear side_effect so that return_value is used for subsequent calls
-            self.mock_client_instance.is_connected.side_effect = None
-        self.mock_client_instance.connect.side_effect = mock_connect
+            self.loop_exited.wait(1)
+        self.mock_client_instance.loop_forever.side_effect = mock_loop_forever
 
         self.handler.start()
-        time.sleep(0.1)
+        self.assertTrue(self.handler.connected_event.wait(0.2))
 
-        self.mock_client_instance.connect.assert_called_once()
-        self.mock_client_instance.loop_start.assert_called_once()
+        self.mock_client_instance.connect_async.assert_called_once_with(MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_KEEPALIVE)
+        self.mock_client_instance.loop_forever.assert_called_once_with(retry_first_connection=True)
+        self.mock_client_instance.loop_start.assert_not_called() # No extra paho thread
         self.mock_client_instance.subscribe.assert_called_with(MOCK_PRINT_TOPIC, qos=MOCK_QOS)
 
         self.handler.stop()
         self.handler.join()
 
-    def test_run_handles_connection_failure_and_retries(self):
-        self.mock_client_instance.is_connected.return_value = False
+    def test_setup_client_delegates_reconnect_to_paho(self):
+        self.handler._setup_client()
+        self.mock_client_instance.reconnect_delay_set.assert_called_once_with(
+            min_delay=1, max_delay=self.handler.reconnect_delay
+        )
+        self.assertIsNotNone(self.handler.client.on_connect_fail)
 
-        call_count = {'count': 0}
-        def connect_side_effect(*args, **kwargs):
-            call_count['count'] +=1
-            if call_count['count'] == 1:
-                raise ConnectionRefusedError("Test refuse")
-            else:
-                self.handler._on_connect(self.mock_client_instance, None, None, 0)
-                self.mock_client_instance.is_connected.return_value = True
-        self.mock_client_instance.connect.side_effect = connect_side_effect
+    def test_run_exits_when_connect_async_fails(self):
+        self.mock_client_instance.connect_async.side_effect = ValueError("Invalid host")
 
         self.handler.start()
-        time.sleep(0.2) # Allow for attempt, delay, retry
+        self.handler.join(timeout=1)
 
-        self.assertEqual(self.mock_client_instance.connect.call_count, 2)
-        self.assertTrue(self.mock_client_instance.is_connected())
+        self.assertFalse(self.handler.is_alive())
+        self.assertFalse(self.handler.running)
+        self.mock_client_instance.loop_forever.assert_not_called()
+
+    def test_stop_while_broker_unreachable(self):
+        self.mock_client_instance.is_connected.return_value = False
+        # The broker never answers, so _on_connect is not called
+
+        self.handler.start()
+        self.assertTrue(self.loop_entered.wait(1))
 
         self.handler.stop()
-        self.handler.join()
+        self.handler.join(timeout=1)
+        self.assertFalse(self.handler.is_alive())
+        self.mock_client_instance.disconnect.assert_called_once() # Cancels paho's pending reconnect
 
     def test_stop_method_disconnects_client(self):
         self.mock_client_instance.is_connected.return_value = True
@@ -146,14 +195,34 @@ class TestPrinterMqttHandler(unittest.TestCase):
         self.handler.client = self.mock_client_instance
 
         self.handler.start()
-        time.sleep(0.05)
+        self.assertTrue(self.loop_entered.wait(1))
 
         self.handler.stop()
         self.handler.join(timeout=1)
 
-        self.mock_client_instance.loop_stop.assert_called_once()
+        self.assertFalse(self.handler.is_alive()) # loop_forever() returned after disconnect()
         self.mock_client_instance.disconnect.assert_called_once()
         self.assertFalse(self.handler.running)
 
+    def test_connect_completing_after_stop_disconnects(self):
+        self.handler._setup_client()
+        self.handler.stop()
+        self.mock_client_instance.disconnect.reset_mock()
+
+        self.handler._on_connect(self.mock_client_instance, None, None, 0)
+
+        self.mock_client_instance.disconnect.assert_called_once()
+        self.mock_client_instance.subscribe.assert_not_called()
+        self.assertFalse(self.handler.connected_event.is_set())
+
+    def test_connect_fail_after_stop_disconnects(self):
+        self.handler._setup_client()
+        self.handler.stop()
+        self.mock_client_instance.disconnect.reset_mock()
+
+        self.handler._on_connect_fail(self.mock_client_instance, None)
+
+        self.mock_client_instance.disconnect.assert_called_once() # Ends paho's backoff wait
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, MagicMock, call
 import queue
+import threading
 import time
 import os
 import serial # type: ignore # To reference serial.SerialException, serial.SerialTimeoutException
@@ -13,11 +14,13 @@ MOCK_PRINTER_TIMEOUT = 1
 
 class TestPrinterSerialHandler(unittest.TestCase):
 
-    def setUp(self):
-        self.mqtt_to_serial_queue = queue.Queue()
+    @classmethod
+    def setUpClass(cls):
+        # Introspect the real Serial class once, before it's patched; mocks reuse the attribute list
+        cls.serial_spec = dir(serial.Serial)
 
-        # Get the original class BEFORE it's patched
-        self.original_serial_class_ref = serial.Serial
+    def setUp(self):
+        self.mqtt_to_serial_queue = queue.SimpleQueue()
 
         self.patcher_serial = patch('serial.Serial')
         self.patcher_os_path_exists = patch('os.path.exists')
@@ -27,8 +30,8 @@ class TestPrinterSerialHandler(unittest.TestCase):
 
         self.mock_os_path_exists.return_value = True # Device exists by default
 
-        # Create an instance mock, specced against the *original* class
-        self.mock_serial_instance = MagicMock(spec=self.original_serial_class_ref)
+        # Create an instance mock, specced against the real Serial's attributes
+        self.mock_serial_instance = MagicMock(spec=self.serial_spec)
         self.mock_serial_instance.is_open = True
         # Make the class mock return our instance mock
         self.mock_serial_class.return_value = self.mock_serial_instance
@@ -38,6 +41,7 @@ class TestPrinterSerialHandler(unittest.TestCase):
             self.mqtt_to_serial_queue
         )
         self.handler.reconnect_delay = 0.05 # Faster reconnects for tests
+        self.handler.max_reconnect_delay = 0.05
 
     def tearDown(self):
         if self.handler.is_alive():
@@ -49,7 +53,6 @@ class TestPrinterSerialHandler(unittest.TestCase):
         while not self.mqtt_to_serial_queue.empty():
             try:
                 self.mqtt_to_serial_queue.get_nowait()
-                self.mqtt_to_serial_queue.task_done()
             except queue.Empty:
                 break
 
@@ -57,9 +60,9 @@ class TestPrinterSerialHandler(unittest.TestCase):
     def test_initialization(self):
         self.assertEqual(self.handler.device_path, MOCK_PRINTER_PORT)
         self.assertFalse(self.handler.running)
+        self.assertTrue(self.handler.daemon)
         self.assertIsNone(self.handler.ser)
 
-    @patch('time.sleep', MagicMock())
     def test_connect_serial_success(self):
         self.assertTrue(self.handler._connect_serial())
         self.mock_serial_class.assert_called_once_with(
@@ -70,42 +73,87 @@ class TestPrinterSerialHandler(unittest.TestCase):
             stopbits=serial.STOPBITS_ONE
         )
         self.assertTrue(self.handler.ser.is_open) # type: ignore
+        self.mock_os_path_exists.assert_not_called() # No stat() when the port opens
 
-    @patch('time.sleep', MagicMock())
     def test_connect_serial_device_not_found(self):
+        self.mock_serial_class.side_effect = serial.SerialException(2, "could not open port")
         self.mock_os_path_exists.return_value = False
         self.assertFalse(self.handler._connect_serial())
-        self.mock_serial_class.assert_not_called()
+        self.mock_os_path_exists.assert_called_once_with(MOCK_PRINTER_PORT)
+        self.assertIsNone(self.handler.ser)
 
-    @patch('time.sleep', MagicMock())
     def test_connect_serial_exception(self):
         self.mock_serial_class.side_effect = serial.SerialException("Printer connection failed")
         self.assertFalse(self.handler._connect_serial())
 
+    def test_reconnect_backoff_is_jittered_capped_and_reset(self):
+        self.handler.reconnect_delay = 1
+        self.handler.max_reconnect_delay = 60
+        self.handler._backoff = 1
+        with patch('random.uniform', side_effect=lambda low, high: high), \
+             patch.object(self.handler._stop_event, 'wait') as mock_wait:
+            for _ in range(5):
+                self.handler._wait_before_reconnect()
+
+        self.assertEqual([c.args[0] for c in mock_wait.call_args_list], [3, 9, 27, 60, 60])
+        self.assertTrue(self.handler._connect_serial())
+        self.assertEqual(self.handler._backoff, 1) # Back to the base once connected
+
     def test_disconnect_serial(self):
         self.handler._connect_serial() # Connect first
         self.handler._disconnect_serial()
         self.mock_serial_instance.close.assert_called_once()
         self.assertIsNone(self.handler.ser)
 
-    @patch('time.sleep', MagicMock())
     def test_run_writes_message_to_printer(self):
-        message = "Hello Printer"
+        message = b'Hello Printer\n'
         self.mqtt_to_serial_queue.put(message)
 
         self.handler.start()
-        time.sleep(0.1) # Allow thread to process
+        self.assertTrue(self.handler.processed_event.wait(timeout=1.0))
 
-        expected_payload = message.encode('ascii') + b'\n'
-        self.mock_serial_instance.write.assert_called_once_with(expected_payload)
+        self.mock_serial_instance.write.assert_called_once_with(message)
         self.assertTrue(self.mqtt_to_serial_queue.empty())
 
         self.handler.stop()
         self.handler.join()
 
-    @patch('time.sleep', MagicMock())
+    def test_run_coalesces_queued_messages_into_one_write(self):
+        messages = [b'first\n', b'second\n', b'third\n']
+        for message in messages:
+            self.mqtt_to_serial_queue.put(message)
+
+        self.handler.start()
+        self.assertTrue(self.handler.processed_event.wait(timeout=1.0))
+
+        self.mock_serial_instance.write.assert_called_once_with(b'first\nsecond\nthird\n')
+        self.assertTrue(self.mqtt_to_serial_queue.empty())
+
+        self.handler.stop()
+        self.handler.join()
+
+    def test_run_caps_batch_size(self):
+        self.handler.max_batch_messages = 2
+        for message in [b'a\n', b'b\n', b'c\n']:
+            self.mqtt_to_serial_queue.put(message)
+
+        both_written = threading.Event()
+        self.mock_serial_instance.write.side_effect = (
+            lambda data: both_written.set() if self.mock_serial_instance.write.call_count == 2 else None
+        )
+        self.handler.start()
+        self.assertTrue(both_written.wait(1))
+
+        self.assertEqual(
+            self.mock_serial_instance.write.call_args_list,
+            [call(b'a\nb\n'), call(b'c\n')]
+        )
+
+        self.handler.stop()
+        self.handler.join()
+
     def test_run_requeues_on_serial_timeout_exception(self):
-        message = "Timeout Test"
+        message = b'Timeout Test\n'
         self.mqtt_to_serial_queue.put(message)
 
         # Simulate write timeout
@@ -124,9 +172,8 @@ class TestPrinterSerialHandler(unittest.TestCase):
         # Check if disconnect was called to force reconnect
         self.mock_serial_instance.close.assert_called() # _disconnect_serial should be called
 
-    @patch('time.sleep', MagicMock())
     def test_run_requeues_on_serial_exception_during_write(self):
-        message = "SerialExc Test"
+        message = b'SerialExc Test\n'
         self.mqtt_to_serial_queue.put(message)
         self.mock_serial_instance.write.side_effect = serial.SerialException("General Serial Error")
 
@@ -142,9 +189,8 @@ class TestPrinterSerialHandler(unittest.TestCase):
         self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), message)
         self.mock_serial_instance.close.assert_called() # _disconnect_serial should be called
 
-    @patch('time.sleep', MagicMock())
     def test_run_requeues_on_os_error_during_write(self):
-        message = "OSError Test"
+        message = b'OSError Test\n'
         self.mqtt_to_serial_queue.put(message)
         self.mock_serial_instance.write.side_effect = OSError("Device not configured")
 
@@ -161,7 +207,7 @@ class TestPrinterSerialHandler(unittest.TestCase):
         self.mock_serial_instance.close.assert_called() # _disconnect_serial should be called
 
     def test_run_reconnects_after_write_failure_and_prints_requeued_message(self):
-        message = "Recover Print"
+        message = b'Recover Print\n'
         self.mqtt_to_serial_queue.put(message)
 
         # Fail first write, then succeed
@@ -176,7 +222,7 @@ class TestPrinterSerialHandler(unittest.TestCase):
         # Mock os.path.exists to allow reconnect
         self.mock_os_path_exists.return_value = True
         # Mock serial.Serial to return a new mock instance on reconnect attempt
-        new_mock_serial_instance = MagicMock(spec=self.original_serial_class_ref) # Use the stored original class ref
+        new_mock_serial_instance = MagicMock(spec=self.serial_spec)
         new_mock_serial_instance.is_open = True
 
         # First call to serial.Serial is the initial one in setUp.
@@ -185,15 +231,43 @@ class TestPrinterSerialHandler(unittest.TestCase):
 
 
         self.handler.start()
-        time.sleep(0.2) # Allow for fail, requeue, reconnect, retry
+        # Only the retry on the new port succeeds, so this waits out fail, requeue and reconnect
+        self.assertTrue(self.handler.processed_event.wait(timeout=1.0))
 
         self.assertEqual(self.mock_serial_instance.write.call_count, 1) # Original mock called once (failed)
-        new_mock_serial_instance.write.assert_called_once_with(message.encode('ascii') + b'\n') # New mock called
+        new_mock_serial_instance.write.assert_called_once_with(message) # New mock called
         self.assertTrue(self.mqtt_to_serial_queue.empty()) # Message should be processed
 
         self.handler.stop()
         self.handler.join()
 
+    def test_run_prints_failed_batch_before_messages_queued_meanwhile(self):
+        self.mqtt_to_serial_queue.put(b'first\n')
+
+        def failing_write(data):
+            self.mqtt_to_serial_queue.put(b'late\n') # Arrives while the write is failing
+            raise serial.SerialException("Simulated write fail")
+        self.mock_serial_instance.write.side_effect = failing_write
+
+        both_written = threading.Event()
+        new_mock_serial_instance = MagicMock(spec=self.serial_spec)
+        new_mock_serial_instance.is_open = True
+        new_mock_serial_instance.write.side_effect = (
+            lambda data: both_written.set() if new_mock_serial_instance.write.call_count == 2 else None
+        )
+        self.mock_serial_class.side_effect = [self.mock_serial_instance, new_mock_serial_instance]
+
+        self.handler.start()
+        self.assertTrue(both_written.wait(1))
+
+        self.assertEqual(
+            new_mock_serial_instance.write.call_args_list,
+            [call(b'first\n'), call(b'late\n')]
+        )
+
+        self.handler.stop()
+        self.handler.join()
+
     def test_stop_method(self):
         self.handler.start()
         self.assertTrue(self.handler.is_alive())
@@ -202,5 +276,26 @@ class TestPrinterSerialHandler(unittest.TestCase):
         self.assertFalse(self.handler.is_alive())
         self.assertFalse(self.handler.running)
 
+    def test_stop_wakes_idle_run_loop(self):
+        self.handler.queue_poll_timeout = 5 # Longer than the join timeout below
+        self.handler.start()
+        time.sleep(0.05) # Let the thread block on the empty queue
+
+        self.handler.stop()
+        self.handler.join(timeout=1)
+        self.assertFalse(self.handler.is_alive())
+        self.assertTrue(self.mqtt_to_serial_queue.empty()) # Wake-up marker is not left behind
+
+    def test_stop_cuts_short_reconnect_backoff(self):
+        self.handler.reconnect_delay = 30 # Longer than the join timeout below
+        self.handler.max_reconnect_delay = 30
+        self.mock_serial_class.side_effect = serial.SerialException("Printer connection failed")
+        self.handler.start()
+        self.assertTrue(self.handler.running)
+
+        self.handler.stop()
+        self.handler.join(timeout=1)
+        self.assertFalse(self.handler.is_alive())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+import functools
+import os
+from dataclasses import dataclass
+
+# MQTT Configuration defaults, used when the matching environment variable is unset
+MQTT_BROKER_HOST_DEFAULT = "mqtt.example.com"
+MQTT_BROKER_PORT_DEFAULT = 8883
+MQTT_USERNAME_DEFAULT = "scale_user"
+MQTT_PASSWORD_DEFAULT = "scale_password"
+MQTT_CLIENT_ID_DEFAULT = "scale_daemon_client"
+MQTT_DATA_TOPIC_DEFAULT = "laboratory/scale/data"
+MQTT_COMMAND_TOPIC_DEFAULT = "laboratory/scale/command"
+MQTT_QOS_DEFAULT = 2
+MQTT_KEEPALIVE_DEFAULT = 60  # seconds
+MQTT_USE_TLS_DEFAULT = True
+
+# Spellings accepted as "on" for boolean environment variables
+_TRUE = frozenset({"true", "1", "yes", "on"})
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in _TRUE
+
+
+@dataclass(frozen=True, slots=True)
+class ScaleConfig:
+    """Scale daemon settings decoded from the environment."""
+
+    broker_host: str
+    broker_port: int
+    username: str
+    password: str
+    client_id: str
+    data_topic: str
+    command_topic: str
+    qos: int
+    keepalive: int
+    use_tls: bool
+    integration_test: bool
+
+
+@functools.cache
+def load_config() -> ScaleConfig:
+    """
+    Reads the MQTT settings from the environment, falling back to the defaults above.
+    The result is cached, so any .env file must be loaded before the first call.
+    """
+    env = os.environ
+    return ScaleConfig(
+        broker_host=env.get("MQTT_BROKER_HOST", MQTT_BROKER_HOST_DEFAULT),
+        broker_port=int(env.get("MQTT_BROKER_PORT", MQTT_BROKER_PORT_DEFAULT)),
+        username=env.get("MQTT_USERNAME", MQTT_USERNAME_DEFAULT),
+        password=env.get("MQTT_PASSWORD", MQTT_PASSWORD_DEFAULT),
+        # Though client_id is often fixed per device type
+        client_id=env.get("MQTT_CLIENT_ID", MQTT_CLIENT_ID_DEFAULT),
+        data_topic=env.get("MQTT_DATA_TOPIC", MQTT_DATA_TOPIC_DEFAULT),
+        command_topic=env.get("MQTT_COMMAND_TOPIC", MQTT_COMMAND_TOPIC_DEFAULT),
+        qos=int(env.get("MQTT_QOS", MQTT_QOS_DEFAULT)),
+        keepalive=int(env.get("MQTT_KEEPALIVE", MQTT_KEEPALIVE_DEFAULT)),
+        use_tls=_env_bool("MQTT_USE_TLS", MQTT_USE_TLS_DEFAULT),
+        integration_test=env.get("RUN_INTEGRATION_TEST") == "true",
+    )
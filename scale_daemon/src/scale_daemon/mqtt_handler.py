@@ -1,14 +1,49 @@
+import json
 import logging
 import threading
-import time
 import paho.mqtt.client as mqtt # type: ignore
+import socket
 import ssl
 
+logger = logging.getLogger(__name__)
+
+class _ResumingSSLSocket(ssl.SSLSocket):
+    """Saves its TLS session on the context when closed, so the next connection can resume it."""
+
+    def close(self):
+        if self.session is not None:
+            self.context.last_session = self.session
+        super().close()
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """
+    Client context that offers the last connection's TLS session on every new socket.
+    paho wraps its own sockets, so this is the only place to pass session= through.
+    """
+    sslsocket_class = _ResumingSSLSocket
+    last_session: ssl.SSLSession | None = None
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        return super().wrap_socket(sock, *args, session=session or self.last_session, **kwargs)
+
+def _create_tls_context() -> ssl.SSLContext:
+    """
+    Client context with session resumption: certificate and hostname checks against the
+    system CAs, the X.509 verify flags ssl.create_default_context() sets on Python 3.13+,
+    and TLS 1.3 only, whose full handshake and PSK resumption each take one round trip
+    fewer than 1.2.
+    """
+    ctx = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT) # CERT_REQUIRED and hostname checks
+    ctx.verify_flags |= ssl.VERIFY_X509_STRICT | ssl.VERIFY_X509_PARTIAL_CHAIN
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_3
+    ctx.load_default_certs()
+    return ctx
+
 class ScaleMqttHandler(threading.Thread):
     def __init__(self, broker_host, port, username, password, client_id,
                  data_topic, command_topic, qos, keepalive,
-                 serial_to_mqtt_queue, mqtt_to_serial_queue, use_tls: bool = True):
-        super().__init__(name="ScaleMqttHandlerThread")
+                 send_command, use_tls: bool = True):
+        super().__init__(name="ScaleMqttHandlerThread", daemon=True)
         self.broker_host = broker_host
         self.port = port
         self.username = username
@@ -18,157 +53,179 @@ class ScaleMqttHandler(threading.Thread):
         self.command_topic = command_topic
         self.qos = qos
         self.keepalive = keepalive
-        self.serial_to_mqtt_queue = serial_to_mqtt_queue # Data from Serial to publish
-        self.mqtt_to_serial_queue = mqtt_to_serial_queue # Commands to Serial
+        self.send_command = send_command # Called with each command byte, e.g. ScaleSerialHandler.send_command
         self.use_tls = use_tls
+        # Built once so client rebuilds don't reload the system CA store each time,
+        # and so reconnects can resume the previous TLS session
+        self._ssl_ctx = _create_tls_context() if use_tls else None
         self.running = False
         self.client: mqtt.Client | None = None
         self.connection_rc = -1 # To store connection result code
-        self.reconnect_delay = 5 # seconds
+        self.connected_event = threading.Event() # Set while connected to the broker
+        self.echo_events: dict[str, threading.Event] = {} # corr_id -> Event set when that payload comes back
+        self._stop_event = threading.Event() # Set by stop() to end run()
+        self.reconnect_delay = 5 # seconds, upper bound of paho's reconnect backoff
 
-        logging.info(f"ScaleMqttHandler initialized for broker {self.broker_host}:{self.port} (TLS: {self.use_tls}).")
+        logger.info("ScaleMqttHandler initialized for broker %s:%s (TLS: %s).", self.broker_host, self.port, self.use_tls)
+        # The serial thread may publish before run() connects; with the client built here,
+        # paho holds those QoS 1/2 readings until the first connection instead of them being dropped
+        self._setup_client()
 
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         self.connection_rc = rc # Store result code
         if rc == 0:
-            logging.info(f"Successfully connected to MQTT broker {self.broker_host}:{self.port}. Subscribing...")
+            self.connected_event.set()
+            logger.info("Successfully connected to MQTT broker %s:%s. Subscribing...", self.broker_host, self.port)
             # Subscribe to the command topic
             client.subscribe(self.command_topic, qos=self.qos)
-            logging.info(f"Subscribed to {self.command_topic} with QoS {self.qos}.")
+            logger.info("Subscribed to %s with QoS %s.", self.command_topic, self.qos)
         else:
-            logging.error(f"Failed to connect to MQTT broker: {mqtt.connack_string(rc)}")
+            logger.error("Failed to connect to MQTT broker: %s", mqtt.connack_string(rc))
 
     def _on_disconnect(self, client, userdata, flags, reasoncode, properties=None):
+        self.connected_event.clear()
         if isinstance(reasoncode, int): # For older paho-mqtt or v1 style rc
-            logging.warning(f"Disconnected from MQTT broker: {mqtt.connack_string(reasoncode)}. Will attempt to reconnect.")
+            logger.warning("Disconnected from MQTT broker: %s. Will attempt to reconnect.", mqtt.connack_string(reasoncode))
         else: # For paho-mqtt v2 ReasonCode object
-            logging.warning(f"Disconnected from MQTT broker: {reasoncode}. Will attempt to reconnect.")
-        # Reconnection will be handled by the run loop
+            logger.warning("Disconnected from MQTT broker: %s. Will attempt to reconnect.", reasoncode)
+        # Reconnection is handled by paho's network loop
+
+    def _on_socket_open(self, client, userdata, sock):
+        # Called before CONNECT is sent. Small packets (readings) would otherwise wait
+        # on Nagle's algorithm for the broker's delayed ACK, up to ~40 ms each.
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.warning("Could not disable Nagle on the MQTT socket: %s", e)
+
+    def _on_connect_fail(self, client, userdata):
+        logger.error("MQTT connection to %s:%s failed. Retrying with backoff.", self.broker_host, self.port)
 
     def _on_message(self, client, userdata, msg: mqtt.MQTTMessage):
         try:
-            logging.info(f"Received MQTT message on topic '{msg.topic}': {msg.payload!r}")
+            logger.debug("Received MQTT message on topic '%s': %r", msg.topic, msg.payload)
             if msg.topic == self.command_topic:
                 if msg.payload and len(msg.payload) > 0:
                     # Scale expects single byte commands
                     command_byte = msg.payload[0:1] # Take the first byte
-                    self.mqtt_to_serial_queue.put(command_byte)
-                    logging.info(f"Command '{command_byte!r}' put to mqtt_to_serial_queue.")
+                    self.send_command(command_byte)
                 else:
-                    logging.warning("Received empty payload on command topic.")
+                    logger.warning("Received empty payload on command topic.")
+            elif msg.topic == self.data_topic:
+                self._match_echo(msg.payload)
             else:
-                logging.warning(f"Received message on unexpected topic: {msg.topic}")
+                logger.warning("Received message on unexpected topic: %s", msg.topic)
         except Exception as e:
-            logging.error(f"Error processing MQTT message: {e}")
+            logger.error("Error processing MQTT message: %s", e)
+
+    def _match_echo(self, payload: bytes):
+        """Sets the echo event whose corr_id matches a payload we published ourselves."""
+        try:
+            corr_id = json.loads(payload).get("corr_id")
+        except (ValueError, AttributeError):
+            return # Not one of our JSON probes
+        event = self.echo_events.pop(corr_id, None)
+        if event:
+            logger.info("Echo received for corr_id %s.", corr_id)
+            event.set()
+
+    def watch_for_echo(self, corr_id: str) -> threading.Event:
+        """
+        Subscribes to the data topic and returns an Event that is set once a
+        JSON payload carrying this corr_id is delivered back to us.
+        """
+        event = threading.Event()
+        self.echo_events[corr_id] = event
+        if self.client:
+            self.client.subscribe(self.data_topic, qos=self.qos)
+        return event
 
     def _on_publish(self, client, userdata, mid, reason_code, properties=None):
-        logging.debug(f"MQTT message published successfully (MID: {mid}, ReasonCode: {reason_code}).")
+        logger.debug("MQTT message published successfully (MID: %s, ReasonCode: %s).", mid, reason_code)
 
     def _setup_client(self):
         try:
             self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id)
             self.client.username_pw_set(self.username, self.password)
             if self.use_tls:
-                logging.info("Configuring MQTT client with TLS.")
-                self.client.tls_set(
-                    # ca_certs=None, # Not needed if server cert is from public CA
-                    # certfile=None, # Client cert not required
-                    # keyfile=None,  # Client key not required
-                    cert_reqs=ssl.CERT_REQUIRED, # Validate server certificate
-                    tls_version=ssl.PROTOCOL_TLS_CLIENT,
-                )
-                # For TLSv1.2 and TLSv1.3, PROTOCOL_TLS_CLIENT should pick the highest.
+                logger.info("Configuring MQTT client with TLS.")
+                # Shared resuming context (see _create_tls_context): verified certs and hostname, TLS 1.3 only
+                self.client.tls_set_context(self._ssl_ctx)
             else:
-                logging.info("Configuring MQTT client without TLS.")
+                logger.info("Configuring MQTT client without TLS.")
 
+            # paho's network loop reconnects on its own, backing off from 1s up to reconnect_delay
+            self.client.reconnect_delay_set(min_delay=1, max_delay=self.reconnect_delay)
             self.client.on_connect = self._on_connect
+            self.client.on_connect_fail = self._on_connect_fail
+            self.client.on_socket_open = self._on_socket_open
             self.client.on_disconnect = self._on_disconnect
             self.client.on_message = self._on_message
             self.client.on_publish = self._on_publish
             return True
         except Exception as e:
-            logging.error(f"Error setting up MQTT client: {e}")
+            logger.error("Error setting up MQTT client: %s", e)
             self.client = None
             return False
 
     def run(self):
         self.running = True
-        logging.info("ScaleMqttHandler thread started.")
+        logger.info("ScaleMqttHandler thread started.")
 
-        if not self._setup_client() or not self.client:
-            logging.error("MQTT client setup failed. Thread cannot start.")
+        # Normally built in __init__; retried here in case that attempt failed
+        if self.client is None and not self._setup_client():
+            logger.error("MQTT client setup failed. Thread cannot start.")
             self.running = False # Stop the thread if setup fails
             return
 
-        while self.running:
-            if not self.client.is_connected():
-                try:
-                    logging.info(f"Attempting to connect to MQTT broker {self.broker_host}:{self.port}...")
-                    self.connection_rc = -1 # Reset before connect attempt
-                    self.client.connect(self.broker_host, self.port, self.keepalive)
-                    self.client.loop_start() # Start network loop in background thread
-                    # Wait for connection result via _on_connect callback
-                    connect_timeout = time.time() + 10 # 10 seconds timeout for connection
-                    while self.connection_rc == -1 and time.time() < connect_timeout and self.running:
-                        time.sleep(0.1)
-
-                    if self.connection_rc != 0 and self.running: # Check self.running again in case stop was called
-                        logging.error(f"MQTT connection failed after attempt. Will retry in {self.reconnect_delay}s.")
-                        self.client.loop_stop() # Stop loop if connect failed
-                        time.sleep(self.reconnect_delay)
-                        continue # Retry connection
-                    elif not self.running: # stop() was called during connection attempt
-                        break
-
-                except ConnectionRefusedError:
-                    logging.error(f"MQTT ConnectionRefusedError. Broker may be down or unreachable. Retrying in {self.reconnect_delay}s.")
-                    time.sleep(self.reconnect_delay)
-                    continue
-                except Exception as e:
-                    logging.error(f"Error connecting to MQTT broker: {e}. Retrying in {self.reconnect_delay}s.")
-                    if self.client.is_connected(): # Should not happen if connect failed, but good practice
-                        self.client.loop_stop()
-                    time.sleep(self.reconnect_delay)
-                    continue
-
-            # If connected, process outgoing messages
-            if self.client.is_connected():
-                try:
-                    if not self.serial_to_mqtt_queue.empty():
-                        message_str: str = self.serial_to_mqtt_queue.get()
-                        payload = message_str.encode('utf-8')
-                        result = self.client.publish(self.data_topic, payload, qos=self.qos)
-                        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                            logging.info(f"Published to '{self.data_topic}': {message_str} (MID: {result.mid})")
-                        else:
-                            logging.error(f"Failed to publish message: {mqtt.error_string(result.rc)}. Re-queuing.")
-                            # Basic re-queue, consider more robust dead-letter or retry limit
-                            self.serial_to_mqtt_queue.put(message_str)
-                            # If publish fails consistently, it might indicate a deeper issue.
-                            # For QoS 1 & 2, paho handles retries if broker ACKs are not received.
-                            # This error here is more about initial send failure.
-                        self.serial_to_mqtt_queue.task_done()
-                except Exception as e:
-                    logging.error(f"Error publishing MQTT message: {e}")
-                    # Potentially re-queue or handle error
-
-            time.sleep(0.01)  # Small delay
-
-        # Cleanup when loop exits
-        if self.client:
-            if self.client.is_connected():
-                logging.info("Disconnecting MQTT client...")
-                self.client.loop_stop() # Stop the network loop
-                self.client.disconnect()
-            else: # If loop_stop was called due to connection failure, ensure disconnect is attempted
-                self.client.loop_stop() # Ensure loop is stopped
-        logging.info("ScaleMqttHandler thread stopped.")
+        try:
+            logger.info("Connecting to MQTT broker %s:%s...", self.broker_host, self.port)
+            self.client.connect_async(self.broker_host, self.port, self.keepalive)
+            self.client.loop_start() # Connects, sends, receives and reconnects in paho's own thread
+        except Exception as e:
+            logger.error("Error starting MQTT client: %s", e)
+            self.running = False
+            return
+
+        # Readings are handed to publish() by the serial thread, so just wait to be stopped.
+        self._stop_event.wait()
+
+        if self.connected_event.is_set():
+            logger.info("Disconnecting MQTT client...")
+        self.client.disconnect() # Also ends any pending reconnect wait in the network loop
+        self.client.loop_stop()
+        logger.info("ScaleMqttHandler thread stopped.")
+
+    def publish(self, message) -> bool:
+        """
+        Publishes one reading (bytes as sent, or str to be UTF-8 encoded) to the data topic.
+        Safe to call from other threads: paho's network thread does the sending, and
+        at QoS 1/2 it keeps messages published while disconnected until it reconnects.
+        """
+        client = self.client
+        if client is None:
+            logger.warning("MQTT client setup failed. Dropping message: %r", message)
+            return False
+        try:
+            payload = message if isinstance(message, bytes) else message.encode('utf-8')
+            result = client.publish(self.data_topic, payload, qos=self.qos)
+        except Exception as e:
+            logger.error("Error publishing MQTT message: %s", e)
+            return False
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            logger.debug("Published to '%s': %r (MID: %s)", self.data_topic, message, result.mid)
+            return True
+        if result.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0:
+            logger.warning("Not connected. Message for '%s' will be sent on reconnect (MID: %s)", self.data_topic, result.mid)
+            return True
+        logger.error("Failed to publish message: %s", mqtt.error_string(result.rc))
+        return False
 
     def stop(self):
         self.running = False
-        logging.info("Stopping ScaleMqttHandler thread...")
-        # The join() in main will wait for the run loop to exit
+        self._stop_event.set()
+        logger.info("Stopping ScaleMqttHandler thread...")
 
     def is_connected_for_test(self) -> bool:
         """Checks if the MQTT client is currently connected."""
-        return self.client is not None and self.client.is_connected()
+        return self.connected_event.is_set()
@@ -1,40 +1,48 @@
 import logging
+import random
 import threading
 import time
 import serial # type: ignore
 import os
 
+logger = logging.getLogger(__name__)
+
 class ScaleSerialHandler(threading.Thread):
-    def __init__(self, device_path, baudrate, timeout, serial_to_mqtt_queue, mqtt_to_serial_queue):
-        super().__init__(name="ScaleSerialHandlerThread")
+    def __init__(self, device_path, baudrate, timeout, publish):
+        super().__init__(name="ScaleSerialHandlerThread", daemon=True)
         self.device_path = device_path
         self.baudrate = baudrate
         self.timeout = timeout
-        self.serial_to_mqtt_queue = serial_to_mqtt_queue
-        self.mqtt_to_serial_queue = mqtt_to_serial_queue
-        self.running = False
+        self.publish = publish # Called with each reading, e.g. ScaleMqttHandler.publish
         self.ser: serial.Serial | None = None
-        self.reconnect_delay = 5 # seconds
+        # send_command() runs on the MQTT thread; this keeps its write from racing a close
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event() # Set by stop(); run() loops until then
+        self.reconnect_delay = 1 # seconds, base of the jittered reconnect backoff
+        self.max_reconnect_delay = 60 # seconds
+        self._backoff = self.reconnect_delay
+        # A reading identical to the last one is only republished after this long, since
+        # scales repeat a steady weight at 10-20 Hz. 0 publishes every line.
+        self.repeat_interval = 1.0 # seconds
+        self._last_reading: bytes | None = None
+        self._last_time = 0.0
         self.mock_mode = os.getenv("MOCK_SERIAL_DEVICES") == "true"
 
         if self.mock_mode:
-            logging.info(
-                f"ScaleSerialHandler initialized in MOCK MODE for {self.device_path}."
+            logger.info(
+                "ScaleSerialHandler initialized in MOCK MODE for %s.", self.device_path
             )
         else:
-            logging.info(
-                f"ScaleSerialHandler initialized for {self.device_path} at {self.baudrate} baud."
+            logger.info(
+                "ScaleSerialHandler initialized for %s at %s baud.", self.device_path, self.baudrate
             )
 
     def _connect_serial(self):
         """Attempts to connect to the serial port or simulates connection in mock mode."""
         if self.mock_mode:
-            logging.info(f"MOCK MODE: Simulating successful connection to {self.device_path}.")
+            logger.info("MOCK MODE: Simulating successful connection to %s.", self.device_path)
             return True
 
-        if not os.path.exists(self.device_path):
-            logging.warning(f"Serial device {self.device_path} not found. Will retry in {self.reconnect_delay}s.")
-            return False
         try:
             self.ser = serial.Serial(
                 self.device_path,
@@ -44,103 +52,161 @@ class ScaleSerialHandler(threading.Thread):
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
             )
-            logging.info(f"Successfully connected to serial port {self.device_path}.")
-            return True
-        except serial.SerialException as e:
-            logging.error(f"Failed to connect to {self.device_path}: {e}. Will retry.")
+        except (serial.SerialException, OSError) as e:
             self.ser = None
+            # The path is only checked once opening fails, to tell an unplugged scale from other errors
+            if not os.path.exists(self.device_path):
+                logger.warning("Serial device %s not found. Will retry with backoff.", self.device_path)
+            else:
+                logger.error("Failed to connect to %s: %s. Will retry.", self.device_path, e)
             return False
+        logger.info("Successfully connected to serial port %s.", self.device_path)
+        self._enable_low_latency()
+        self._backoff = self.reconnect_delay
+        return True
+
+    def _enable_low_latency(self):
+        """
+        Sets ASYNC_LOW_LATENCY so USB adapters (FTDI's 16 ms latency timer) hand over each
+        reading as soon as it arrives. Only pyserial's Linux backend has this; failures are harmless.
+        """
+        set_low_latency_mode = getattr(self.ser, "set_low_latency_mode", None)
+        if set_low_latency_mode is None:
+            return
+        try:
+            set_low_latency_mode(True)
+        except ValueError as e: # pyserial wraps the ioctl error; not every driver supports it
+            logger.debug("Low-latency mode not available on %s: %s", self.device_path, e)
 
     def _disconnect_serial(self):
         """Disconnects the serial port if connected or simulates in mock mode."""
         if self.mock_mode:
-            logging.info(f"MOCK MODE: Simulating disconnection from {self.device_path}.")
+            logger.info("MOCK MODE: Simulating disconnection from %s.", self.device_path)
             self.ser = None # Ensure it's None
             return
 
-        if self.ser and self.ser.is_open:
+        with self._write_lock:
+            if self.ser and self.ser.is_open:
+                try:
+                    self.ser.close()
+                    logger.info("Closed serial port %s.", self.device_path)
+                except Exception as e:
+                    logger.error("Error closing serial port %s: %s", self.device_path, e)
+            self.ser = None
+
+    def _wait_before_reconnect(self):
+        """
+        Sleeps for a decorrelated-jitter backoff: min(cap, uniform(base, 3 * previous)).
+        Scales that lose power together then don't all hit udev and the port at once.
+        """
+        self._backoff = min(self.max_reconnect_delay,
+                            random.uniform(self.reconnect_delay, self._backoff * 3))
+        logger.debug("Retrying %s in %.1fs.", self.device_path, self._backoff)
+        self._stop_event.wait(self._backoff) # Returns early if stop() is called
+
+    def _publish_lines(self, buffer: bytearray):
+        """
+        Publishes every complete LF-terminated line in buffer, leaving any partial line behind.
+        Repeats of the previous reading within repeat_interval are dropped.
+        """
+        while True:
+            end = buffer.find(b'\n')
+            if end < 0:
+                return
+            line = bytes(buffer[:end]).strip()
+            del buffer[:end + 1]
+            if line: # Ensure not empty after strip
+                if not line.isascii():
+                    # Line noise: publish U+FFFD for stray bytes rather than invalid UTF-8
+                    line = line.decode('ascii', errors='replace').encode('utf-8')
+                now = time.monotonic()
+                if line == self._last_reading and now - self._last_time < self.repeat_interval:
+                    continue
+                self._last_reading = line
+                self._last_time = now
+                logger.debug("Read from scale: %r", line)
+                self.publish(line) # ASCII readings go out as-is, with no decode/encode round trip
+
+    def send_command(self, command: bytes) -> bool:
+        """
+        Writes a command straight to the scale. Safe to call from the MQTT thread.
+        Returns False if the port is not open or the write fails; the command is dropped.
+        """
+        if self.mock_mode:
+            logger.info("MOCK MODE: Received command for scale: %r (not sent to device)", command)
+            return True
+
+        with self._write_lock:
+            if not (self.ser and self.ser.is_open):
+                logger.warning("Serial port %s not open. Dropping command %r.", self.device_path, command)
+                return False
             try:
-                self.ser.close()
-                logging.info(f"Closed serial port {self.device_path}.")
-            except Exception as e:
-                logging.error(f"Error closing serial port {self.device_path}: {e}")
-        self.ser = None
+                logger.info("Sending command to scale: %r", command)
+                self.ser.write(command)
+                return True
+            except (serial.SerialException, OSError) as e:
+                # The run loop hits the same error on its next read and reconnects
+                logger.error("Failed to send command to %s: %s", self.device_path, e)
+                return False
+
+    @property
+    def running(self):
+        """True between start() and stop(); kept for callers that used the old flag."""
+        return self.is_alive() and not self._stop_event.is_set()
 
     def run(self):
-        self.running = True
-        logging.info("ScaleSerialHandler thread started.")
+        logger.info("ScaleSerialHandler thread started.")
         buffer = bytearray() # Only used in non-mock mode
 
-        while self.running:
+        while not self._stop_event.is_set():
             if self.mock_mode:
                 # --- MOCK MODE ---
-                if not self.mqtt_to_serial_queue.empty():
-                    command: bytes = self.mqtt_to_serial_queue.get()
-                    logging.info(f"MOCK MODE: Received command for scale: {command!r} (not sent to device)")
-                    self.mqtt_to_serial_queue.task_done()
-
-                # Simulate work or just pause to prevent busy loop
+                # Nothing to read; commands are logged by send_command(). Idle until stop().
+                self._stop_event.wait()
                 # If mock data needs to be sent to MQTT:
-                # self.serial_to_mqtt_queue.put("MOCK_SCALE_DATA")
-                time.sleep(0.1)
+                # self.publish("MOCK_SCALE_DATA")
                 continue # Skip real serial logic
 
             # --- NON-MOCK MODE (original logic mostly from here) ---
             if self.ser is None or not self.ser.is_open:
                 self._disconnect_serial()
                 if not self._connect_serial():
-                    time.sleep(self.reconnect_delay)
+                    self._wait_before_reconnect()
                     continue
 
             try:
-                # 1. Read commands from MQTT queue and write to scale
-                if not self.mqtt_to_serial_queue.empty():
-                    command: bytes = self.mqtt_to_serial_queue.get()
-                    # Ensure self.ser is valid before using (it should be if not in mock_mode and connected)
-                    if self.ser and self.ser.is_open:
-                        logging.info(f"Sending command to scale: {command!r}")
-                        self.ser.write(command)
-                    self.mqtt_to_serial_queue.task_done()
-
-                # 2. Read data from scale
+                # Read data from scale (commands are written by send_command())
                 # Ensure self.ser is valid before using
-                if self.ser and self.ser.is_open and self.ser.in_waiting > 0:
-                    byte = self.ser.read(1)
-                    if byte:
-                        if byte == b'\n': # LF character
-                            if buffer:
-                                message_str = buffer.decode('ascii', errors='replace').strip()
-                                if message_str: # Ensure not empty after strip
-                                    logging.info(f"Read from scale: {message_str}")
-                                    self.serial_to_mqtt_queue.put(message_str)
-                                buffer.clear()
-                        else:
-                            buffer.append(byte[0])
+                if self.ser and self.ser.is_open:
+                    # Take everything the driver has buffered in one read(). When nothing is
+                    # buffered, read(1) blocks for up to the port timeout, pacing this loop.
+                    data = self.ser.read(self.ser.in_waiting or 1)
+                    if data:
+                        buffer.extend(data)
+                        self._publish_lines(buffer)
                     else: # Read timed out
                         pass
-                elif self.ser and not self.ser.is_open: # Port closed unexpectedly
-                    logging.warning(f"Serial port {self.device_path} closed unexpectedly. Attempting to reconnect.")
+                elif self.ser: # Port closed unexpectedly
+                    logger.warning("Serial port %s closed unexpectedly. Attempting to reconnect.", self.device_path)
                     self._disconnect_serial() # Clean up
 
             except serial.SerialException as e:
-                logging.error(f"SerialException in ScaleSerialHandler: {e}. Attempting to reconnect.")
+                logger.error("SerialException in ScaleSerialHandler: %s. Attempting to reconnect.", e)
                 self._disconnect_serial()
-                time.sleep(self.reconnect_delay) # Wait before trying to reconnect
+                self._wait_before_reconnect()
             except OSError as e: # This can happen if the device is unplugged
-                 logging.error(f"OSError (device likely disconnected): {e}. Attempting to reconnect.")
+                 logger.error("OSError (device likely disconnected): %s. Attempting to reconnect.", e)
                  self._disconnect_serial()
-                 time.sleep(self.reconnect_delay)
+                 self._wait_before_reconnect()
             except Exception as e:
-                logging.error(f"Unexpected error in ScaleSerialHandler: {e}")
+                logger.error("Unexpected error in ScaleSerialHandler: %s", e)
                 # Decide if a reconnect is appropriate or if it's a fatal error for the thread
-                time.sleep(1) # Prevent rapid looping on unexpected errors
-
-            time.sleep(0.01)  # Small delay to prevent busy-looping
+                self._stop_event.wait(1) # Prevent rapid looping on unexpected errors
 
         self._disconnect_serial()
-        logging.info("ScaleSerialHandler thread stopped.")
+        logger.info("ScaleSerialHandler thread stopped.")
 
     def stop(self):
-        self.running = False
-        logging.info("Stopping ScaleSerialHandler thread...")
+        self._stop_event.set() # Wakes run() from a backoff wait or an idle mock mode
+        logger.info("Stopping ScaleSerialHandler thread...")
         # The join() in main will wait for the run loop to exit
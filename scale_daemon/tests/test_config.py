@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+import dataclasses
+
+from scale_daemon import config as scale_config
+
+
+class TestScaleConfig(unittest.TestCase):
+
+    def setUp(self):
+        scale_config.load_config.cache_clear()
+        self.addCleanup(scale_config.load_config.cache_clear)
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_load_config_defaults(self):
+        config = scale_config.load_config()
+        self.assertEqual(config.broker_host, scale_config.MQTT_BROKER_HOST_DEFAULT)
+        self.assertEqual(config.broker_port, scale_config.MQTT_BROKER_PORT_DEFAULT)
+        self.assertEqual(config.qos, scale_config.MQTT_QOS_DEFAULT)
+        self.assertEqual(config.keepalive, scale_config.MQTT_KEEPALIVE_DEFAULT)
+        self.assertEqual(config.use_tls, scale_config.MQTT_USE_TLS_DEFAULT)
+        self.assertFalse(config.integration_test)
+
+    @patch.dict('os.environ', {
+        "MQTT_BROKER_HOST": "broker.local",
+        "MQTT_BROKER_PORT": "1883",
+        "MQTT_QOS": "1",
+        "MQTT_USE_TLS": "No",
+        "RUN_INTEGRATION_TEST": "true",
+    }, clear=True)
+    def test_load_config_from_environment(self):
+        config = scale_config.load_config()
+        self.assertEqual(config.broker_host, "broker.local")
+        self.assertEqual(config.broker_port, 1883)
+        self.assertEqual(config.qos, 1)
+        self.assertFalse(config.use_tls)
+        self.assertTrue(config.integration_test)
+
+    @patch.dict('os.environ', {"MQTT_USE_TLS": "ON"}, clear=True)
+    def test_use_tls_accepts_on(self):
+        self.assertTrue(scale_config.load_config().use_tls)
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_load_config_is_cached_and_frozen(self):
+        config = scale_config.load_config()
+        self.assertIs(scale_config.load_config(), config)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            config.qos = 0 # type: ignore[misc]
+
+if __name__ == '__main__':
+    unittest.main()
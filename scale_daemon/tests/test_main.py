@@ -1,9 +1,11 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 import logging
+import signal
 
 # Assuming scale_daemon.main is accessible
 from scale_daemon import main as scale_main
+from scale_daemon import config as scale_config
 # from scale_daemon.main import setup_logging, main as run_main_logic # More specific imports
 
 class TestScaleMain(unittest.TestCase):
@@ -19,9 +21,10 @@ class TestScaleMain(unittest.TestCase):
     @patch('scale_daemon.main.ScaleSerialHandler')
     @patch('scale_daemon.main.ScaleMqttHandler')
     @patch('scale_daemon.main.setup_logging')
-    @patch('time.sleep', side_effect=KeyboardInterrupt) # To break the main loop
+    @patch('scale_daemon.main.shutdown_event') # wait() returns at once, as if signalled
+    @patch('signal.signal')
     def test_main_starts_and_stops_handlers(
-            self, mock_time_sleep, mock_setup_logging,
+            self, mock_signal, mock_shutdown_event, mock_setup_logging,
             MockMqttHandler, MockSerialHandler):
 
         mock_serial_instance = MagicMock()
@@ -32,39 +35,43 @@ class TestScaleMain(unittest.TestCase):
         MockMqttHandler.return_value = mock_mqtt_instance
         mock_mqtt_instance.is_alive.return_value = True # Simulate alive then stopped
 
-        try:
-            scale_main.main()
-        except KeyboardInterrupt:
-            pass # Expected
+        scale_config.load_config.cache_clear()
+        self.addCleanup(scale_config.load_config.cache_clear)
+        scale_main.main()
 
         mock_setup_logging.assert_called_once()
+        mock_signal.assert_any_call(signal.SIGINT, scale_main.request_shutdown)
+        mock_signal.assert_any_call(signal.SIGTERM, scale_main.request_shutdown)
+        mock_shutdown_event.wait.assert_called_once_with()
 
         MockSerialHandler.assert_called_once_with(
             scale_main.SERIAL_DEVICE_PATH,
             scale_main.SERIAL_BAUDRATE,
             scale_main.SERIAL_TIMEOUT,
-            scale_main.serial_to_mqtt_queue,
-            scale_main.mqtt_to_serial_queue
+            mock_mqtt_instance.publish, # Readings go straight to the MQTT handler
         )
         mock_serial_instance.start.assert_called_once()
 
         # Determine the expected use_tls value based on the default string
-        expected_use_tls = scale_main.MQTT_USE_TLS_DEFAULT
+        expected_use_tls = scale_config.MQTT_USE_TLS_DEFAULT
 
         MockMqttHandler.assert_called_once_with(
-            scale_main.MQTT_BROKER_HOST_DEFAULT,
-            scale_main.MQTT_BROKER_PORT_DEFAULT,
-            scale_main.MQTT_USERNAME_DEFAULT,
-            scale_main.MQTT_PASSWORD_DEFAULT,
-            scale_main.MQTT_CLIENT_ID_DEFAULT,
-            scale_main.MQTT_DATA_TOPIC_DEFAULT,
-            scale_main.MQTT_COMMAND_TOPIC_DEFAULT,
-            scale_main.MQTT_QOS_DEFAULT,
-            scale_main.MQTT_KEEPALIVE_DEFAULT,
-            scale_main.serial_to_mqtt_queue,
-            scale_main.mqtt_to_serial_queue,
+            scale_config.MQTT_BROKER_HOST_DEFAULT,
+            scale_config.MQTT_BROKER_PORT_DEFAULT,
+            scale_config.MQTT_USERNAME_DEFAULT,
+            scale_config.MQTT_PASSWORD_DEFAULT,
+            scale_config.MQTT_CLIENT_ID_DEFAULT,
+            scale_config.MQTT_DATA_TOPIC_DEFAULT,
+            scale_config.MQTT_COMMAND_TOPIC_DEFAULT,
+            scale_config.MQTT_QOS_DEFAULT,
+            scale_config.MQTT_KEEPALIVE_DEFAULT,
+            ANY,
             use_tls=expected_use_tls
         )
+        # Commands go straight to the serial handler
+        send_command = MockMqttHandler.call_args.args[9]
+        send_command(b'T')
+        mock_serial_instance.send_command.assert_called_once_with(b'T')
         mock_mqtt_instance.start.assert_called_once()
 
         # Check stop and join calls
@@ -75,5 +82,35 @@ class TestScaleMain(unittest.TestCase):
         mock_serial_instance.stop.assert_called_once()
         mock_serial_instance.join.assert_called_once()
 
+    @patch('scale_daemon.main.load_config')
+    @patch('scale_daemon.main.ScaleSerialHandler')
+    @patch('scale_daemon.main.ScaleMqttHandler')
+    @patch('scale_daemon.main.setup_logging')
+    @patch('scale_daemon.main.shutdown_event')
+    @patch('signal.signal')
+    def test_main_uses_given_config(
+            self, mock_signal, mock_shutdown_event, mock_setup_logging,
+            MockMqttHandler, MockSerialHandler, mock_load_config):
+        config = scale_config.ScaleConfig(
+            broker_host="broker.local", broker_port=1883, username="u", password="p",
+            client_id="c", data_topic="d", command_topic="cmd", qos=1, keepalive=30,
+            use_tls=False, integration_test=False,
+        )
+
+        scale_main.main(config)
+
+        mock_load_config.assert_not_called()
+        MockMqttHandler.assert_called_once_with(
+            "broker.local", 1883, "u", "p", "c", "d", "cmd", 1, 30,
+            ANY,
+            use_tls=False
+        )
+
+    def test_request_shutdown_sets_event(self):
+        scale_main.shutdown_event.clear()
+        scale_main.request_shutdown(signal.SIGTERM, None)
+        self.assertTrue(scale_main.shutdown_event.is_set())
+        scale_main.shutdown_event.clear()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,10 @@
 import unittest
 from unittest.mock import patch, MagicMock, ANY
-import queue
-import time
+import threading
+import socket
 import ssl
 
-from scale_daemon.mqtt_handler import ScaleMqttHandler
+from scale_daemon.mqtt_handler import ScaleMqttHandler, _ResumingSSLSocket
 import paho.mqtt.client as paho_mqtt # type: ignore
 
 # Mock MQTT constants
@@ -20,18 +20,19 @@ MOCK_KEEPALIVE = 60
 
 class TestScaleMqttHandler(unittest.TestCase):
 
-    def setUp(self):
-        self.serial_to_mqtt_queue = queue.Queue() # Data from serial to publish
-        self.mqtt_to_serial_queue = queue.Queue() # Commands to serial
+    @classmethod
+    def setUpClass(cls):
+        # Introspect the real Client once; every test's mock reuses the attribute list
+        cls.client_spec = dir(paho_mqtt.Client)
 
-        # Get the original class before it's patched
-        original_client_class = paho_mqtt.Client
+    def setUp(self):
+        self.send_command = MagicMock() # Stands in for ScaleSerialHandler.send_command
 
         self.patcher_mqtt_client = patch('paho.mqtt.client.Client')
         self.mock_mqtt_client_class = self.patcher_mqtt_client.start() # This is the mock for the CLASS
 
-        # Create an instance mock, specced against the original class
-        self.mock_client_instance = MagicMock(spec=original_client_class)
+        # Create an instance mock, specced against the real Client's attributes
+        self.mock_client_instance = MagicMock(spec=self.client_spec)
         self.mock_client_instance.is_connected.return_value = False # Start as not connected
         # Make the class mock return our instance mock
         self.mock_mqtt_client_class.return_value = self.mock_client_instance
@@ -39,10 +40,13 @@ class TestScaleMqttHandler(unittest.TestCase):
         self.handler = ScaleMqttHandler(
             MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_USERNAME, MOCK_PASSWORD,
             MOCK_CLIENT_ID, MOCK_DATA_TOPIC, MOCK_COMMAND_TOPIC, MOCK_QOS,
-            MOCK_KEEPALIVE, self.serial_to_mqtt_queue, self.mqtt_to_serial_queue
+            MOCK_KEEPALIVE, self.send_command
         )
         # Shorten reconnect delay for tests
         self.handler.reconnect_delay = 0.1
+        # The client was built in __init__; start each test with clean call records
+        self.mock_mqtt_client_class.reset_mock()
+        self.mock_client_instance.reset_mock()
 
     def tearDown(self):
         if self.handler.is_alive():
@@ -53,23 +57,69 @@ class TestScaleMqttHandler(unittest.TestCase):
     def test_initialization(self):
         self.assertEqual(self.handler.broker_host, MOCK_BROKER_HOST)
         self.assertFalse(self.handler.running)
-        self.assertIsNone(self.handler.client) # Client is None until _setup_client
+        self.assertTrue(self.handler.daemon)
+        self.assertIs(self.handler.client, self.mock_client_instance) # Built before start()
 
     @patch('time.sleep', MagicMock())
     def test_setup_client_success(self):
         self.assertTrue(self.handler._setup_client())
         self.mock_mqtt_client_class.assert_called_once_with(paho_mqtt.CallbackAPIVersion.VERSION2, client_id=MOCK_CLIENT_ID)
         self.mock_client_instance.username_pw_set.assert_called_once_with(MOCK_USERNAME, MOCK_PASSWORD)
-        self.mock_client_instance.tls_set.assert_called_once_with(
-            cert_reqs=ssl.CERT_REQUIRED,
-            tls_version=ssl.PROTOCOL_TLS_CLIENT
-        )
+        self.mock_client_instance.tls_set_context.assert_called_once_with(self.handler._ssl_ctx)
+        self.assertEqual(self.handler._ssl_ctx.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(self.handler._ssl_ctx.check_hostname)
+        self.assertEqual(self.handler._ssl_ctx.minimum_version, ssl.TLSVersion.TLSv1_3)
+        self.assertTrue(self.handler._ssl_ctx.verify_flags & ssl.VERIFY_X509_STRICT)
+        self.assertTrue(self.handler._ssl_ctx.verify_flags & ssl.VERIFY_X509_PARTIAL_CHAIN)
+        self.assertFalse(self.handler._ssl_ctx.options & ssl.OP_NO_TICKET) # Tickets left on for resumption
         self.assertIsNotNone(self.handler.client)
         self.assertIsNotNone(self.handler.client.on_connect)
         self.assertIsNotNone(self.handler.client.on_disconnect)
         self.assertIsNotNone(self.handler.client.on_message)
         self.assertIsNotNone(self.handler.client.on_publish)
 
+    def test_setup_client_reuses_ssl_context(self):
+        self.handler._setup_client()
+        self.handler._setup_client()
+        contexts = [c.args[0] for c in self.mock_client_instance.tls_set_context.call_args_list]
+        self.assertEqual(len(contexts), 2)
+        self.assertIs(contexts[0], contexts[1])
+
+    def test_ssl_context_offers_last_session(self):
+        ctx = self.handler._ssl_ctx
+        self.assertIs(ctx.sslsocket_class, _ResumingSSLSocket)
+        ctx.last_session = MagicMock(spec=ssl.SSLSession)
+        with patch.object(ssl.SSLContext, 'wrap_socket') as mock_wrap:
+            ctx.wrap_socket("sock", server_hostname=MOCK_BROKER_HOST, do_handshake_on_connect=False)
+        mock_wrap.assert_called_once_with(
+            "sock", server_hostname=MOCK_BROKER_HOST, do_handshake_on_connect=False,
+            session=ctx.last_session
+        )
+
+    def test_ssl_socket_close_saves_session(self):
+        sock = MagicMock(spec=_ResumingSSLSocket)
+        sock.context = self.handler._ssl_ctx
+        with patch.object(ssl.SSLSocket, 'close'):
+            _ResumingSSLSocket.close(sock)
+        self.assertIs(self.handler._ssl_ctx.last_session, sock.session)
+
+    def test_socket_open_disables_nagle(self):
+        self.handler._setup_client()
+        self.assertEqual(self.handler.client.on_socket_open, self.handler._on_socket_open)
+        mock_sock = MagicMock()
+        self.handler._on_socket_open(self.mock_client_instance, None, mock_sock)
+        mock_sock.setsockopt.assert_called_once_with(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def test_setup_client_without_tls(self):
+        handler = ScaleMqttHandler(
+            MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_USERNAME, MOCK_PASSWORD,
+            MOCK_CLIENT_ID, MOCK_DATA_TOPIC, MOCK_COMMAND_TOPIC, MOCK_QOS,
+            MOCK_KEEPALIVE, self.send_command, use_tls=False
+        )
+        self.assertIsNone(handler._ssl_ctx)
+        self.assertTrue(handler._setup_client())
+        self.mock_client_instance.tls_set_context.assert_not_called()
+
     @patch('time.sleep', MagicMock())
     def test_setup_client_failure_exception(self):
         self.mock_mqtt_client_class.side_effect = Exception("Setup error")
@@ -88,6 +138,15 @@ class TestScaleMqttHandler(unittest.TestCase):
         self.mock_client_instance.subscribe.assert_not_called()
         self.assertEqual(self.handler.connection_rc, 5)
 
+    def test_connected_event_tracks_connection_state(self):
+        self.handler._setup_client()
+        self.handler._on_connect(self.mock_client_instance, None, None, 5) # Refused
+        self.assertFalse(self.handler.connected_event.is_set())
+        self.handler._on_connect(self.mock_client_instance, None, None, 0)
+        self.assertTrue(self.handler.connected_event.is_set())
+        self.handler._on_disconnect(self.mock_client_instance, None, None, 7)
+        self.assertFalse(self.handler.connected_event.is_set())
+
     def test_on_message_command_topic(self):
         self.handler._setup_client()
         mock_msg = MagicMock(spec=paho_mqtt.MQTTMessage)
@@ -95,7 +154,7 @@ class TestScaleMqttHandler(unittest.TestCase):
         mock_msg.payload = b'T' # Single byte command
 
         self.handler._on_message(self.mock_client_instance, None, mock_msg)
-        self.assertEqual(self.mqtt_to_serial_queue.get_nowait(), b'T')
+        self.send_command.assert_called_once_with(b'T')
 
     def test_on_message_command_topic_empty_payload(self):
         self.handler._setup_client()
@@ -104,7 +163,7 @@ class TestScaleMqttHandler(unittest.TestCase):
         mock_msg.payload = b''
 
         self.handler._on_message(self.mock_client_instance, None, mock_msg)
-        self.assertTrue(self.mqtt_to_serial_queue.empty())
+        self.send_command.assert_not_called()
 
     def test_on_message_unexpected_topic(self):
         self.handler._setup_client()
@@ -113,7 +172,33 @@ class TestScaleMqttHandler(unittest.TestCase):
         mock_msg.payload = b'data'
 
         self.handler._on_message(self.mock_client_instance, None, mock_msg)
-        self.assertTrue(self.mqtt_to_serial_queue.empty())
+        self.send_command.assert_not_called()
+
+    def test_watch_for_echo_subscribes_and_sets_event(self):
+        self.handler._setup_client()
+        event = self.handler.watch_for_echo("abc123")
+        self.mock_client_instance.subscribe.assert_called_once_with(MOCK_DATA_TOPIC, qos=MOCK_QOS)
+        self.assertFalse(event.is_set())
+
+        mock_msg = MagicMock(spec=paho_mqtt.MQTTMessage)
+        mock_msg.topic = MOCK_DATA_TOPIC
+        mock_msg.payload = b'{"type": "integration_test", "corr_id": "other"}'
+        self.handler._on_message(self.mock_client_instance, None, mock_msg)
+        self.assertFalse(event.is_set())
+
+        mock_msg.payload = b'{"type": "integration_test", "corr_id": "abc123"}'
+        self.handler._on_message(self.mock_client_instance, None, mock_msg)
+        self.assertTrue(event.is_set())
+        self.assertNotIn("abc123", self.handler.echo_events)
+
+    def test_on_message_data_topic_ignores_non_json(self):
+        self.handler._setup_client()
+        mock_msg = MagicMock(spec=paho_mqtt.MQTTMessage)
+        mock_msg.topic = MOCK_DATA_TOPIC
+        mock_msg.payload = b'12.5 g'
+
+        self.handler._on_message(self.mock_client_instance, None, mock_msg) # Should not raise
+        self.send_command.assert_not_called()
 
     def test_on_publish_callback_signature(self):
         """
@@ -134,88 +219,116 @@ class TestScaleMqttHandler(unittest.TestCase):
             self.fail(f"_on_publish callback raised TypeError unexpectedly: {e}")
 
     def test_run_connects_and_subscribes(self):
-        # is_connected will be called once before connect, should return False.
-        # After connect, mock_connect will set return_value to True.
-        self.mock_client_instance.is_connected.side_effect = [False]
-
-        # Simulate successful connection via callback
-        def mock_connect(*args, **kwargs):
+        # paho's network loop connects in the background and then calls _on_connect
+        def mock_loop_start(*args, **kwargs):
             self.handler._on_connect(self.mock_client_instance, None, None, 0) # rc=0
             self.mock_client_instance.is_connected.return_value = True # Update connected state
-            # Clear side_effect so that return_value is used for subsequent calls
-            self.mock_client_instance.is_connected.side_effect = None
-        self.mock_client_instance.connect.side_effect = mock_connect
+        self.mock_client_instance.loop_start.side_effect = mock_loop_start
 
         self.handler.start()
-        time.sleep(0.1) # Allow thread to run
+        self.assertTrue(self.handler.connected_event.wait(0.2)) # Allow thread to run
 
-        self.mock_client_instance.connect.assert_called_once_with(MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_KEEPALIVE)
+        self.mock_client_instance.connect_async.assert_called_once_with(MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_KEEPALIVE)
         self.mock_client_instance.loop_start.assert_called_once()
-        # Subscription happens in _on_connect, which is called by mock_connect
+        # Subscription happens in _on_connect, which is called by mock_loop_start
         self.mock_client_instance.subscribe.assert_called_with(MOCK_COMMAND_TOPIC, qos=MOCK_QOS)
 
         self.handler.stop()
         self.handler.join()
 
-    @patch('time.sleep', MagicMock())
-    def test_run_publishes_message_from_queue(self):
-        self.mock_client_instance.is_connected.return_value = True # Assume connected
+    def test_setup_client_delegates_reconnect_to_paho(self):
+        self.handler._setup_client()
+        self.mock_client_instance.reconnect_delay_set.assert_called_once_with(
+            min_delay=1, max_delay=self.handler.reconnect_delay
+        )
+        self.assertIsNotNone(self.handler.client.on_connect_fail)
 
-        # Simulate successful connection and _on_connect being called
+    def test_publish_encodes_message(self):
         self.handler._setup_client()
-        self.handler.client = self.mock_client_instance # Ensure client is set
-        self.handler._on_connect(self.mock_client_instance, None, None, 0)
+        self.mock_client_instance.publish.return_value = MagicMock(rc=paho_mqtt.MQTT_ERR_SUCCESS, mid=123)
 
+        self.assertTrue(self.handler.publish("scale_data_123"))
+        self.mock_client_instance.publish.assert_called_once_with(
+            MOCK_DATA_TOPIC, b"scale_data_123", qos=MOCK_QOS
+        )
 
-        message_to_publish = "scale_data_123"
-        self.serial_to_mqtt_queue.put(message_to_publish)
+    def test_publish_sends_preencoded_bytes_unchanged(self):
+        self.handler._setup_client()
+        self.mock_client_instance.publish.return_value = MagicMock(rc=paho_mqtt.MQTT_ERR_SUCCESS, mid=1)
+        payload = b'{"type": "integration_test"}'
 
-        # Mock publish result
-        mock_publish_result = MagicMock()
-        mock_publish_result.rc = paho_mqtt.MQTT_ERR_SUCCESS
-        mock_publish_result.mid = 123
-        self.mock_client_instance.publish.return_value = mock_publish_result
+        self.assertTrue(self.handler.publish(payload))
+        self.mock_client_instance.publish.assert_called_once_with(MOCK_DATA_TOPIC, payload, qos=MOCK_QOS)
 
-        self.handler.start() # Start the thread after setup for this specific test flow
-        time.sleep(0.1)
+    def test_publish_while_disconnected_is_kept_by_paho(self):
+        self.handler._setup_client()
+        self.mock_client_instance.publish.return_value = MagicMock(rc=paho_mqtt.MQTT_ERR_NO_CONN, mid=7)
 
-        self.mock_client_instance.publish.assert_called_once_with(
-            MOCK_DATA_TOPIC, message_to_publish.encode('utf-8'), qos=MOCK_QOS
+        self.assertTrue(self.handler.publish("12.5 g")) # QoS 2: paho sends it after reconnecting
+
+        self.handler.qos = 0
+        self.assertFalse(self.handler.publish("12.5 g")) # QoS 0: paho drops it
+
+    def test_publish_before_run_is_kept_by_paho(self):
+        # The serial thread can read the scale before run() has connected
+        self.mock_client_instance.publish.return_value = MagicMock(rc=paho_mqtt.MQTT_ERR_NO_CONN, mid=1)
+
+        self.assertTrue(self.handler.publish("12.5 g"))
+        self.mock_client_instance.publish.assert_called_once_with(MOCK_DATA_TOPIC, b"12.5 g", qos=MOCK_QOS)
+
+        # The same client, with the reading in its outgoing queue, is the one run() connects
+        loop_started = threading.Event()
+        self.mock_client_instance.loop_start.side_effect = loop_started.set
+        self.handler.start()
+        self.assertTrue(loop_started.wait(1))
+        self.mock_mqtt_client_class.assert_not_called()
+        self.mock_client_instance.connect_async.assert_called_once_with(MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_KEEPALIVE)
+
+    def test_publish_after_failed_client_setup_is_dropped(self):
+        self.mock_mqtt_client_class.side_effect = Exception("Setup error")
+        handler = ScaleMqttHandler(
+            MOCK_BROKER_HOST, MOCK_BROKER_PORT, MOCK_USERNAME, MOCK_PASSWORD,
+            MOCK_CLIENT_ID, MOCK_DATA_TOPIC, MOCK_COMMAND_TOPIC, MOCK_QOS,
+            MOCK_KEEPALIVE, self.send_command
         )
-        self.assertTrue(self.serial_to_mqtt_queue.empty())
+        self.assertIsNone(handler.client)
+        self.assertFalse(handler.publish("12.5 g"))
+        self.mock_client_instance.publish.assert_not_called()
 
-        self.handler.stop()
-        self.handler.join()
+    def test_run_exits_when_connect_async_fails(self):
+        self.mock_client_instance.connect_async.side_effect = ValueError("Invalid host")
+
+        self.handler.start()
+        self.handler.join(timeout=1)
+
+        self.assertFalse(self.handler.is_alive())
+        self.assertFalse(self.handler.running)
+        self.mock_client_instance.loop_start.assert_not_called()
 
-    def test_run_handles_connection_refused_and_retries(self):
+    def test_stop_while_broker_unreachable(self):
         self.mock_client_instance.is_connected.return_value = False
-        # First connect attempt raises ConnectionRefusedError, second succeeds
-        call_count = {'count': 0}
-        def connect_side_effect(*args, **kwargs):
-            call_count['count'] +=1
-            if call_count['count'] == 1:
-                raise ConnectionRefusedError("Connection refused by broker")
-            else: # Second attempt
-                self.handler._on_connect(self.mock_client_instance, None, None, 0) # Simulate success
-                self.mock_client_instance.is_connected.return_value = True # Update state
-        self.mock_client_instance.connect.side_effect = connect_side_effect
+        # The broker never answers, so _on_connect is not called
 
+        loop_started = threading.Event()
+        self.mock_client_instance.loop_start.side_effect = loop_started.set
         self.handler.start()
-        time.sleep(0.3) # Allow for initial attempt, delay, and retry
-
-        self.assertEqual(self.mock_client_instance.connect.call_count, 2)
-        self.assertTrue(self.mock_client_instance.is_connected())
+        self.assertTrue(loop_started.wait(1))
 
         self.handler.stop()
-        self.handler.join()
+        self.handler.join(timeout=1)
+        self.assertFalse(self.handler.is_alive())
+        self.mock_client_instance.disconnect.assert_called_once() # Cancels paho's pending reconnect
+        self.mock_client_instance.loop_stop.assert_called_once()
 
     def test_stop_method_disconnects_client(self):
         self.mock_client_instance.is_connected.return_value = True
         self.handler._setup_client() # Ensure self.client is set
         self.handler.client = self.mock_client_instance
 
+        loop_started = threading.Event()
+        self.mock_client_instance.loop_start.side_effect = loop_started.set
         self.handler.start()
-        time.sleep(0.05) # Let it run briefly
+        self.assertTrue(loop_started.wait(1)) # Running, waiting to be stopped
 
         self.handler.stop()
         self.handler.join(timeout=1)
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, MagicMock, call
 import queue
+import threading
 import time
 import os
 import serial
@@ -21,8 +22,7 @@ MOCK_TIMEOUT = 1
 class TestScaleSerialHandler(unittest.TestCase):
 
     def setUp(self):
-        self.serial_to_mqtt_queue = queue.Queue()
-        self.mqtt_to_serial_queue = queue.Queue()
+        self.serial_to_mqtt_queue = queue.SimpleQueue() # Collects what the handler publishes
         # Patch 'serial.Serial' and 'os.path.exists' for all tests in this class
         self.patcher_serial = patch('serial.Serial')
         self.patcher_os_path_exists = patch('os.path.exists')
@@ -37,14 +37,36 @@ class TestScaleSerialHandler(unittest.TestCase):
         self.mock_serial_instance = MagicMock()
         self.mock_serial_instance.is_open = True # Start as open
         self.mock_serial_instance.in_waiting = 0
+        self.mock_serial_instance.read.return_value = b'' # Idle port: read() times out empty
         self.mock_serial_class.return_value = self.mock_serial_instance
 
         self.handler = ScaleSerialHandler(
             MOCK_SERIAL_PORT, MOCK_BAUDRATE, MOCK_TIMEOUT,
-            self.serial_to_mqtt_queue, self.mqtt_to_serial_queue
+            self.serial_to_mqtt_queue.put
         )
-        # Shorten reconnect delay for tests to speed them up
-        self.handler.reconnect_delay = 0.1
+        # No backoff wait between reconnect attempts in tests
+        self.handler.reconnect_delay = 0
+        self.handler.max_reconnect_delay = 0
+
+    def _feed_reads(self, *chunks):
+        """Makes read() return (or raise) chunks in order, then time out empty like an idle port."""
+        pending = list(chunks)
+        def read(size=1):
+            if not pending:
+                return b''
+            item = pending.pop(0)
+            if isinstance(item, Exception):
+                raise item
+            return item
+        self.mock_serial_instance.read.side_effect = read
+
+    def _wait_until(self, predicate, timeout=1.0):
+        """Polls predicate until it holds, so tests wait only as long as the handler thread needs."""
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the handler thread.")
+            time.sleep(0.001)
 
     def tearDown(self):
         if self.handler.is_alive():
@@ -57,9 +79,9 @@ class TestScaleSerialHandler(unittest.TestCase):
         self.assertEqual(self.handler.device_path, MOCK_SERIAL_PORT)
         self.assertEqual(self.handler.baudrate, MOCK_BAUDRATE)
         self.assertFalse(self.handler.running)
+        self.assertTrue(self.handler.daemon)
         self.assertIsNone(self.handler.ser) # ser is None until _connect_serial is called
 
-    @patch('time.sleep', MagicMock()) # Mock time.sleep to avoid delays
     def test_connect_serial_success(self):
         self.mock_os_path_exists.return_value = True
         self.assertTrue(self.handler._connect_serial())
@@ -72,21 +94,45 @@ class TestScaleSerialHandler(unittest.TestCase):
         )
         self.assertIsNotNone(self.handler.ser)
         self.assertTrue(self.handler.ser.is_open) # type: ignore
+        self.mock_os_path_exists.assert_not_called() # No stat() when the port opens
 
-    @patch('time.sleep', MagicMock())
     def test_connect_serial_device_not_found(self):
+        self.mock_serial_class.side_effect = serial.SerialException(2, "could not open port") # type: ignore
         self.mock_os_path_exists.return_value = False
         self.assertFalse(self.handler._connect_serial())
-        self.mock_serial_class.assert_not_called()
+        self.mock_os_path_exists.assert_called_once_with(MOCK_SERIAL_PORT)
         self.assertIsNone(self.handler.ser)
 
-    @patch('time.sleep', MagicMock())
     def test_connect_serial_exception(self):
         self.mock_os_path_exists.return_value = True
         self.mock_serial_class.side_effect = serial.SerialException("Connection failed") # type: ignore
         self.assertFalse(self.handler._connect_serial())
         self.assertIsNone(self.handler.ser)
 
+    def test_connect_serial_enables_low_latency(self):
+        self.assertTrue(self.handler._connect_serial())
+        self.mock_serial_instance.set_low_latency_mode.assert_called_once_with(True)
+
+    def test_connect_serial_tolerates_missing_low_latency_support(self):
+        self.mock_serial_instance.set_low_latency_mode.side_effect = ValueError("Failed to update ASYNC_LOW_LATENCY flag")
+        self.assertTrue(self.handler._connect_serial())
+        self.assertIs(self.handler.ser, self.mock_serial_instance)
+
+    def test_reconnect_backoff_is_jittered_capped_and_reset(self):
+        self.handler.reconnect_delay = 1
+        self.handler.max_reconnect_delay = 60
+        self.handler._backoff = 1
+        with patch('random.uniform', side_effect=lambda low, high: high) as mock_uniform, \
+             patch.object(self.handler._stop_event, 'wait') as mock_wait:
+            for _ in range(5):
+                self.handler._wait_before_reconnect()
+
+        self.assertEqual(mock_uniform.call_args_list[1], call(1, 9)) # Grows from the previous delay
+        self.assertEqual([c.args[0] for c in mock_wait.call_args_list], [3, 9, 27, 60, 60])
+
+        self.assertTrue(self.handler._connect_serial())
+        self.assertEqual(self.handler._backoff, 1) # Back to the base once connected
+
     def test_disconnect_serial(self):
         # First connect
         self.handler._connect_serial()
@@ -100,124 +146,181 @@ class TestScaleSerialHandler(unittest.TestCase):
         self.handler._disconnect_serial() # Should not raise error
         self.mock_serial_instance.close.assert_not_called()
 
-    @patch('time.sleep', MagicMock())
     def test_run_reads_from_scale_and_puts_to_queue(self):
-        # Simulate data from scale
-        self.mock_serial_instance.read.side_effect = [b'1', b'2', b'3', b'.', b'5', b'\n', b'O', b'K', b'\n']
-        # Make in_waiting reflect that there's data
-        type(self.mock_serial_instance).in_waiting = unittest.mock.PropertyMock(side_effect=[1,1,1,1,1,1,1,1,1,0,0,0])
-
+        # Simulate data from scale: both lines arrive in one read
+        self._feed_reads(b'123.5\nOK\n')
 
         self.handler.start()
-        time.sleep(0.1) # Give thread time to run and process
 
         # Check queue
         try:
             msg1 = self.serial_to_mqtt_queue.get(timeout=0.5)
-            self.assertEqual(msg1, "123.5")
+            self.assertEqual(msg1, b"123.5")
             msg2 = self.serial_to_mqtt_queue.get(timeout=0.5)
-            self.assertEqual(msg2, "OK")
+            self.assertEqual(msg2, b"OK")
         except queue.Empty:
             self.fail("serial_to_mqtt_queue was empty, expected messages.")
 
         self.handler.stop()
         self.handler.join()
 
-    def test_run_writes_command_to_scale(self):
-        command_to_send = b'T'
-        self.mqtt_to_serial_queue.put(command_to_send)
+    def test_run_reads_all_waiting_bytes_at_once(self):
+        # Two full lines plus the start of a third arrive together, the rest later
+        self._feed_reads(b'12.5 g\r\nST,+0001.2\n99', b'.9\n')
+        in_waiting_sequence = [22, 3]
+        type(self.mock_serial_instance).in_waiting = unittest.mock.PropertyMock(
+            side_effect=lambda: in_waiting_sequence.pop(0) if in_waiting_sequence else 0
+        )
 
         self.handler.start()
-        time.sleep(0.1) # Give thread time to run
 
-        self.mock_serial_instance.write.assert_called_once_with(command_to_send)
+        messages = [self.serial_to_mqtt_queue.get(timeout=0.5) for _ in range(3)]
+        self.assertEqual(messages, [b"12.5 g", b"ST,+0001.2", b"99.9"])
+        self.mock_serial_instance.read.assert_has_calls([call(22), call(3)])
+
+        self.handler.stop()
+        self.handler.join()
+
+    def test_publish_lines_drops_repeats_within_interval(self):
+        self.handler._publish_lines(bytearray(b'12.5 g\n12.5 g\n12.6 g\n12.5 g\n12.5 g\n'))
+        published = [self.serial_to_mqtt_queue.get_nowait() for _ in range(3)]
+        self.assertEqual(published, [b'12.5 g', b'12.6 g', b'12.5 g'])
+        self.assertTrue(self.serial_to_mqtt_queue.empty())
+
+        self.handler.repeat_interval = 0 # A steady reading is republished once the interval passes
+        self.handler._publish_lines(bytearray(b'12.5 g\n'))
+        self.assertEqual(self.serial_to_mqtt_queue.get_nowait(), b'12.5 g')
+
+    def test_publish_lines_replaces_non_ascii_bytes(self):
+        buffer = bytearray(b'1\xff2\npartial')
+        self.handler._publish_lines(buffer)
+        self.assertEqual(self.serial_to_mqtt_queue.get_nowait(), '1\ufffd2'.encode('utf-8'))
+        self.assertEqual(buffer, b'partial')
+
+    def test_send_command_writes_to_scale(self):
+        self.handler.start()
+        self._wait_until(lambda: self.handler.ser is not None) # Port opened
+
+        self.assertTrue(self.handler.send_command(b'T'))
+        self.mock_serial_instance.write.assert_called_once_with(b'T')
+
+        self.handler.stop()
+        self.handler.join()
+
+    def test_send_command_not_blocked_by_pending_read(self):
+        read_entered = threading.Event()
+        release_read = threading.Event()
+        def slow_read(size=1):
+            read_entered.set()
+            release_read.wait(1) # A read waiting out the port timeout
+            return b''
+        self.mock_serial_instance.read.side_effect = slow_read
+
+        self.handler.start()
+        self.assertTrue(read_entered.wait(1))
+        started = time.monotonic()
+        self.assertTrue(self.handler.send_command(b'T'))
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.mock_serial_instance.write.assert_called_once_with(b'T')
 
+        release_read.set()
         self.handler.stop()
         self.handler.join()
 
+    def test_send_command_drops_when_port_closed(self):
+        self.assertFalse(self.handler.send_command(b'T')) # Never connected
+        self.mock_serial_instance.write.assert_not_called()
+
+    def test_send_command_reports_write_error(self):
+        self.handler.ser = self.mock_serial_instance
+        self.mock_serial_instance.write.side_effect = serial.SerialException("Write error") # type: ignore
+        self.assertFalse(self.handler.send_command(b'T'))
+
     def test_run_reconnects_on_serial_exception_during_read(self):
         # Simulate initial successful connection
         self.mock_os_path_exists.return_value = True
 
         # First call to read works, then raises exception, then works again
-        self.mock_serial_instance.read.side_effect = [
-            b'D', b'A', b'T', b'A', b'\n', # Successful read
+        self._feed_reads(
+            b'DATA\n', # Successful read
             serial.SerialException("Read error"), # type: ignore
-            b'R', b'E', b'C', b'O', b'V', b'E', b'R', b'E', b'D', b'\n' # Successful read after reconnect
-        ]
-        # Corrected in_waiting: 1 for each byte of "DATA\n", 1 for the read that raises exception, then 1 for each byte of "RECOVERED\n"
-        type(self.mock_serial_instance).in_waiting = unittest.mock.PropertyMock(side_effect=[1,1,1,1,1, 1, 1,1,1,1,1,1,1,1,1,1, 0])
-
+            b'RECOVERED\n' # Successful read after reconnect
+        )
 
         self.handler.start()
-        time.sleep(0.2) # Allow time for initial read, exception, and reconnect attempt
-
-        # Check if _connect_serial was called multiple times (initial + reconnect attempt)
-        # The first call is in setUp or if run calls it before loop.
-        # The second call should happen after the SerialException.
-        self.assertGreaterEqual(self.mock_serial_class.call_count, 2)
 
         try:
             msg1 = self.serial_to_mqtt_queue.get(timeout=0.5)
-            self.assertEqual(msg1, "DATA")
+            self.assertEqual(msg1, b"DATA")
             msg2 = self.serial_to_mqtt_queue.get(timeout=0.5) # After reconnect
-            self.assertEqual(msg2, "RECOVERED")
+            self.assertEqual(msg2, b"RECOVERED")
         except queue.Empty:
             self.fail("serial_to_mqtt_queue did not contain expected messages after reconnect.")
 
+        # The port was opened again after the SerialException
+        self.assertGreaterEqual(self.mock_serial_class.call_count, 2)
+
         self.handler.stop()
         self.handler.join()
 
     def test_run_handles_device_disappearance_and_reappearance(self):
-        # Device exists initially, then disappears, then reappears
-        self.mock_os_path_exists.side_effect = [
-            True,  # Initial connect
-            False, # Device disappears
-            False, # Still disappeared
-            True,  # Initial connect
-            False, # Device disappears
-            False, # Still disappeared during retry
-            True,  # Device reappears
-            True   # Stays appeared for subsequent checks if any
+        # Device opens initially, then is gone for two attempts, then reappears
+        gone = serial.SerialException(2, "could not open port") # type: ignore
+        self.mock_serial_class.side_effect = [
+            self.mock_serial_instance, gone, gone, self.mock_serial_instance
         ]
+        self.mock_os_path_exists.return_value = False # Only asked while the device is gone
 
         # Simulate read sequence: successful read, then error, then successful read after reconnect
-        self.mock_serial_instance.read.side_effect = (
-            # Bytes for "LIVE\n"
-            [b'L', b'I', b'V', b'E', b'\n'] +
+        self._feed_reads(
+            b'LIVE\n',
             # Error when device is "gone"
-            [serial.SerialException("Simulated device disappearance during read")] +
-            # Bytes for "BACK\n" after reconnect
-            [b'B', b'A', b'C', b'K', b'\n']
-        )
-
-        # Align in_waiting:
-        # 5 ones for "LIVE\n"
-        # 1 one for the read attempt that will raise SerialException
-        # 5 ones for "BACK\n" after successful reconnect
-        # Then zeros
-        in_waiting_sequence = [1]*5 + [1] + [1]*5 + [0]*5 # Ensure enough zeros at the end
-        type(self.mock_serial_instance).in_waiting = unittest.mock.PropertyMock(
-            side_effect=lambda: in_waiting_sequence.pop(0) if in_waiting_sequence else 0
+            serial.SerialException("Simulated device disappearance during read"),
+            # Line after reconnect
+            b'BACK\n'
         )
 
         self.handler.start()
-        time.sleep(0.5) # Allow time for connect, disconnect, reconnect cycle
-
-        self.assertGreaterEqual(self.mock_os_path_exists.call_count, 3) # Initial, check fails, check succeeds
-        self.assertGreaterEqual(self.mock_serial_class.call_count, 2) # Initial connect, reconnect
 
         try:
             msg1 = self.serial_to_mqtt_queue.get(timeout=0.5)
-            self.assertEqual(msg1, "LIVE")
+            self.assertEqual(msg1, b"LIVE")
             msg2 = self.serial_to_mqtt_queue.get(timeout=0.5)
-            self.assertEqual(msg2, "BACK")
+            self.assertEqual(msg2, b"BACK")
         except queue.Empty:
             self.fail("Messages not received after device disappearance and reappearance.")
 
+        self.assertEqual(self.mock_os_path_exists.call_count, 2) # Once per failed open
+        self.assertEqual(self.mock_serial_class.call_count, 4) # Initial, two failures, reconnect
+
         self.handler.stop()
         self.handler.join()
 
+    def test_run_blocks_on_read_when_idle(self):
+        self.handler.start()
+        self._wait_until(lambda: self.mock_serial_instance.read.called)
+
+        # Nothing buffered, so the loop waits in read(1) on the port timeout instead of sleeping
+        self.mock_serial_instance.read.assert_called_with(1)
+
+        self.handler.stop()
+        self.handler.join()
+
+    @patch.dict('os.environ', {"MOCK_SERIAL_DEVICES": "true"})
+    def test_stop_wakes_idle_mock_mode_loop(self):
+        handler = ScaleSerialHandler(
+            MOCK_SERIAL_PORT, MOCK_BAUDRATE, MOCK_TIMEOUT,
+            self.serial_to_mqtt_queue.put
+        )
+        handler.start()
+        time.sleep(0.05) # Let the thread go idle
+        self.assertTrue(handler.send_command(b'T')) # Logged, not written
+        self.mock_serial_class.assert_not_called()
+
+        handler.stop()
+        handler.join(timeout=1)
+        self.assertFalse(handler.is_alive())
+
     def test_stop_method(self):
         self.handler.start()
         self.assertTrue(self.handler.is_alive())
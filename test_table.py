@@ -4,13 +4,21 @@ Generate a comprehensive truth table for GitHub Actions workflow execution
 showing which steps run on which platforms for different events.
 """
 
+import functools
+import heapq
 import os
+import stat
+import tempfile
 import yaml
 import json
-from typing import Dict, List, Tuple, Any, Set
+from typing import Dict, Iterable, Iterator, List, Tuple, Any, Set, Optional
 from dataclasses import dataclass, field
 from enum import Enum
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Prefer the libyaml-backed loader when PyYAML was built against libyaml.
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 class EventType(Enum):
     PUSH_MASTER = "push_master"
@@ -21,7 +29,51 @@ class EventType(Enum):
     WORKFLOW_DISPATCH_ARM64_ONLY = "workflow_dispatch_arm64_only"
     WORKFLOW_DISPATCH_BOTH = "workflow_dispatch_both"
 
-@dataclass
+def _load_workflow(filepath: str) -> Tuple[Any, Optional[Exception]]:
+    """Load a workflow file, returning (workflow, error) instead of raising."""
+    try:
+        with open(filepath, 'rb') as f:
+            return yaml.load(f, Loader=_YAML_LOADER), None
+    except Exception as e:
+        return None, e
+
+@functools.lru_cache(maxsize=None)
+def _condition_cell(condition: str) -> str:
+    """Format a condition for the table: cut to 50 characters, with pipes escaped so they don't split the cell."""
+    if len(condition) > 50:
+        condition = condition[:50] + "..."
+    return condition.replace("|", "\\|")
+
+# Event type ordering (some events are more common/important)
+_EVENT_PRIORITY = {
+    EventType.PUSH_MASTER: 0,
+    EventType.PULL_REQUEST: 1,
+    EventType.MERGE_GROUP: 2,
+    EventType.RELEASE: 3,
+    EventType.WORKFLOW_DISPATCH_BOTH: 4,
+    EventType.WORKFLOW_DISPATCH_AMD64_ONLY: 5,
+    EventType.WORKFLOW_DISPATCH_ARM64_ONLY: 6,
+}
+
+# Common conditions, checked in order; the first one found in an expression decides it
+_CONDITION_HANDLERS = (
+    ("github.event_name != 'release'", lambda event: event != EventType.RELEASE),
+    ("github.event_name == 'release'", lambda event: event == EventType.RELEASE),
+    ("github.event_name == 'workflow_dispatch'", lambda event: event.name.startswith('WORKFLOW_DISPATCH')),
+    ("github.ref == 'refs/heads/master'", lambda event: event == EventType.PUSH_MASTER),
+)
+
+@functools.lru_cache(maxsize=None)
+def _evaluate_condition(condition: str, event: EventType) -> bool:
+    """Evaluate a non-empty condition; cached since the same few repeat across every step and matrix combo."""
+    for needle, handler in _CONDITION_HANDLERS:
+        if needle in condition:
+            return handler(event)
+
+    # Default to true for complex conditions we can't easily evaluate
+    return True
+
+@dataclass(slots=True)
 class StepExecution:
     workflow_file: str
     workflow_name: str
@@ -31,28 +83,41 @@ class StepExecution:
     amd64: bool
     arm64: bool
     condition: str = ""
-    matrix_values: Dict[str, Any] = None
+    matrix_values: Optional[Dict[str, Any]] = None
 
 class WorkflowAnalyzer:
     def __init__(self):
         self.workflows = {}
         self.step_executions = []
+        # Sort-key lookups, filled lazily once the workflows are loaded
+        self._job_order_cache: Dict[str, Dict[str, int]] = {}
+        self._step_order_cache: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._events_cache: Dict[str, List[EventType]] = {}
+        self._matrix_cache: Dict[Tuple[int, Optional[Tuple[str, ...]]], List[Dict]] = {}
 
     def load_workflows(self):
         """Load all workflow files."""
         workflows_dir = '.github/workflows'
-        if not os.path.exists(workflows_dir):
+        try:
+            it = os.scandir(workflows_dir)
+        except FileNotFoundError:
+            return
+
+        with it:
+            entries = [entry for entry in it
+                       if entry.name.endswith(('.yml', '.yaml')) and entry.is_file()]
+        if not entries:
             return
 
-        for filename in os.listdir(workflows_dir):
-            if filename.endswith('.yml') or filename.endswith('.yaml'):
-                filepath = os.path.join(workflows_dir, filename)
-                try:
-                    with open(filepath, 'r') as f:
-                        workflow = yaml.safe_load(f)
-                        self.workflows[filename] = workflow
-                except Exception as e:
-                    print(f"Error loading {filename}: {e}")
+        # Files are independent, so parse them concurrently and collect results in listing order
+        with ThreadPoolExecutor(max_workers=min(8, len(entries))) as ex:
+            results = list(ex.map(_load_workflow, [entry.path for entry in entries]))
+
+        for entry, (workflow, error) in zip(entries, results):
+            if error is not None:
+                print(f"Error loading {entry.name}: {error}")
+            else:
+                self.workflows[entry.name] = workflow
 
     def get_platforms_for_event(self, event: EventType) -> List[str]:
         """Determine platforms based on event type and build.yml logic."""
@@ -73,19 +138,7 @@ class WorkflowAnalyzer:
         """Evaluate GitHub Actions conditional expressions."""
         if not condition:
             return True
-
-        # Handle common conditions
-        if "github.event_name != 'release'" in condition:
-            return event != EventType.RELEASE
-        elif "github.event_name == 'release'" in condition:
-            return event == EventType.RELEASE
-        elif "github.event_name == 'workflow_dispatch'" in condition:
-            return event.name.startswith('WORKFLOW_DISPATCH')
-        elif "github.ref == 'refs/heads/master'" in condition:
-            return event == EventType.PUSH_MASTER
-
-        # Default to true for complex conditions we can't easily evaluate
-        return True
+        return _evaluate_condition(condition, event)
 
     def get_workflow_events(self, workflow: Dict) -> List[EventType]:
         """Get all possible events that can trigger a workflow."""
@@ -138,6 +191,13 @@ class WorkflowAnalyzer:
 
         return events if events else [EventType.PUSH_MASTER]  # Default
 
+    def get_events_for_workflow(self, filename: str, workflow: Dict) -> List[EventType]:
+        """Get the events for a workflow file, computed once per file."""
+        events = self._events_cache.get(filename)
+        if events is None:
+            events = self._events_cache[filename] = self.get_workflow_events(workflow)
+        return events
+
     def expand_matrix(self, matrix_config: Dict, platforms: List[str]) -> List[Dict]:
         """Expand matrix configuration into individual combinations."""
         if not matrix_config:
@@ -183,10 +243,25 @@ class WorkflowAnalyzer:
 
         return combinations
 
+    def get_matrix_combinations(self, matrix_config: Dict, platforms: List[str]) -> List[Dict]:
+        """Expand a job's matrix, reusing the expansion across events when it can't differ."""
+        if not matrix_config:
+            return [{}]
+
+        # Only a dynamic platform entry depends on the event's platforms
+        platform_values = matrix_config.get('platform')
+        dynamic = isinstance(platform_values, str) and '${{' in platform_values
+        # Non-empty matrix configs live in self.workflows, so their id() is stable
+        key = (id(matrix_config), tuple(platforms) if dynamic else None)
+        combinations = self._matrix_cache.get(key)
+        if combinations is None:
+            combinations = self._matrix_cache[key] = self.expand_matrix(matrix_config, platforms)
+        return combinations
+
     def analyze_workflow(self, filename: str, workflow: Dict):
         """Analyze a single workflow file."""
         workflow_name = workflow.get('name', filename)
-        events = self.get_workflow_events(workflow)
+        events = self.get_events_for_workflow(filename, workflow)
 
         # Handle workflow_call separately
         on_config = workflow.get('on', workflow.get(True, {}))
@@ -200,57 +275,9 @@ class WorkflowAnalyzer:
             platforms = self.get_platforms_for_event(event)
 
             for job_name, job_config in jobs.items():
-                # Check job-level conditions
-                job_condition = job_config.get('if', '')
-                if not self.evaluate_condition(job_condition, event, {}):
+                if not self._analyze_job(filename, workflow_name, job_name, job_config, event, platforms):
                     continue
 
-                # Handle strategy matrix
-                strategy = job_config.get('strategy', {})
-                matrix_config = strategy.get('matrix', {})
-                matrix_combinations = self.expand_matrix(matrix_config, platforms)
-
-                steps = job_config.get('steps', [])
-
-                for matrix_combo in matrix_combinations:
-                    # Determine platform(s) for this matrix combination
-                    if 'platform' in matrix_combo:
-                        # Matrix job with platform - runs on ONE specific platform
-                        platform_value = matrix_combo['platform']
-                        if isinstance(platform_value, str):
-                            actual_platforms = [platform_value]
-                        else:
-                            actual_platforms = ['linux/amd64']  # fallback
-                    else:
-                        # No platform matrix - this job runs on default runner (amd64)
-                        # Jobs like prepare_build_vars, determine_platforms run on default runner
-                        actual_platforms = ['linux/amd64']  # Default GitHub runner
-
-                    for step in steps:
-                        step_name = step.get('name', 'Unnamed step')
-                        step_condition = step.get('if', '')
-
-                        if not self.evaluate_condition(step_condition, event, matrix_combo):
-                            continue
-
-                        for actual_platform in actual_platforms:
-                            amd64 = actual_platform == 'linux/amd64'
-                            arm64 = actual_platform == 'linux/arm64'
-
-                            execution = StepExecution(
-                                workflow_file=filename,
-                                workflow_name=workflow_name,
-                                job_name=job_name,
-                                step_name=step_name,
-                                event=event,
-                                amd64=amd64,
-                                arm64=arm64,
-                                condition=step_condition,
-                                matrix_values=matrix_combo
-                            )
-
-                            self.step_executions.append(execution)
-
                 # Handle workflow calls within jobs
                 uses = job_config.get('uses', '')
                 if uses and uses.startswith('./'):
@@ -279,54 +306,65 @@ class WorkflowAnalyzer:
         # Analyze jobs in the called workflow
         jobs = called_workflow_config.get('jobs', {})
 
+        workflow_file = f"{calling_file} → {called_filename}"
+        workflow_name = f"{called_workflow_name} (called)"
         for job_name, job_config in jobs.items():
-            job_condition = job_config.get('if', '')
-            if not self.evaluate_condition(job_condition, event, {}):
-                continue
-
-            strategy = job_config.get('strategy', {})
-            matrix_config = strategy.get('matrix', {})
-            matrix_combinations = self.expand_matrix(matrix_config, platforms)
-
-            steps = job_config.get('steps', [])
-
-            for matrix_combo in matrix_combinations:
-                # Determine platform(s) for this matrix combination in called workflow
-                if 'platform' in matrix_combo:
-                    # Matrix job with platform - runs on ONE specific platform
-                    platform_value = matrix_combo['platform']
-                    if isinstance(platform_value, str):
-                        actual_platforms = [platform_value]
-                    else:
-                        actual_platforms = ['linux/amd64']  # fallback
+            self._analyze_job(workflow_file, workflow_name, job_name, job_config, event, platforms)
+
+    def _analyze_job(self, workflow_file: str, workflow_name: str, job_name: str, job_config: Dict,
+                     event: EventType, platforms: List[str]) -> bool:
+        """Record the steps one job runs for an event; returns False if the job's condition skips it."""
+        # Check job-level conditions
+        job_condition = job_config.get('if', '')
+        if not self.evaluate_condition(job_condition, event, {}):
+            return False
+
+        # Handle strategy matrix
+        strategy = job_config.get('strategy', {})
+        matrix_config = strategy.get('matrix', {})
+        matrix_combinations = self.get_matrix_combinations(matrix_config, platforms)
+
+        # Step conditions don't depend on the matrix combination (evaluate_condition
+        # ignores its context), so the steps that run for this event are picked once
+        steps = []
+        for step in job_config.get('steps', []):
+            step_condition = step.get('if', '')
+            if self.evaluate_condition(step_condition, event, {}):
+                steps.append((step.get('name', 'Unnamed step'), step_condition))
+
+        for matrix_combo in matrix_combinations:
+            # Determine platform(s) for this matrix combination
+            if 'platform' in matrix_combo:
+                # Matrix job with platform - runs on ONE specific platform
+                platform_value = matrix_combo['platform']
+                if isinstance(platform_value, str):
+                    actual_platform = platform_value
                 else:
-                    # No platform matrix - this job doesn't depend on platform
-                    actual_platforms = ['linux/amd64']  # Default GitHub runner
-
-                for step in steps:
-                    step_name = step.get('name', 'Unnamed step')
-                    step_condition = step.get('if', '')
-
-                    if not self.evaluate_condition(step_condition, event, matrix_combo):
-                        continue
-
-                    for platform in actual_platforms:
-                        amd64 = platform == 'linux/amd64'
-                        arm64 = platform == 'linux/arm64'
-
-                        execution = StepExecution(
-                            workflow_file=f"{calling_file} → {called_filename}",
-                            workflow_name=f"{called_workflow_name} (called)",
-                            job_name=job_name,
-                            step_name=step_name,
-                            event=event,
-                            amd64=amd64,
-                            arm64=arm64,
-                            condition=step_condition,
-                            matrix_values=matrix_combo
-                        )
+                    actual_platform = 'linux/amd64'  # fallback
+            else:
+                # No platform matrix - this job runs on default runner (amd64)
+                # Jobs like prepare_build_vars, determine_platforms run on default runner
+                actual_platform = 'linux/amd64'  # Default GitHub runner
+
+            amd64 = actual_platform == 'linux/amd64'
+            arm64 = actual_platform == 'linux/arm64'
+
+            for step_name, step_condition in steps:
+                execution = StepExecution(
+                    workflow_file=workflow_file,
+                    workflow_name=workflow_name,
+                    job_name=job_name,
+                    step_name=step_name,
+                    event=event,
+                    amd64=amd64,
+                    arm64=arm64,
+                    condition=step_condition,
+                    matrix_values=matrix_combo
+                )
+
+                self.step_executions.append(execution)
 
-                        self.step_executions.append(execution)
+        return True
 
     def get_job_dependencies(self, workflow: Dict) -> Dict[str, List[str]]:
         """Parse job dependencies from workflow."""
@@ -345,29 +383,31 @@ class WorkflowAnalyzer:
 
     def topological_sort_jobs(self, dependencies: Dict[str, List[str]]) -> List[str]:
         """Sort jobs in execution order using topological sort."""
-        # Calculate in-degree for each job
+        # Calculate in-degree for each job, and which jobs wait on each job
         in_degree = {job: 0 for job in dependencies.keys()}
+        dependents = defaultdict(list)
         for job, deps in dependencies.items():
             for dep in deps:
                 if dep in in_degree:
                     in_degree[job] += 1
+            for dep in set(deps):  # Released once per dependency, as before, even if listed twice
+                dependents[dep].append(job)
 
         # Initialize queue with jobs that have no dependencies
         queue = [job for job, degree in in_degree.items() if degree == 0]
+        heapq.heapify(queue)
         result = []
 
         while queue:
-            # Sort queue to ensure deterministic order for jobs at same level
-            queue.sort()
-            job = queue.pop(0)
+            # Min-heap on the name gives a deterministic order for jobs at the same level
+            job = heapq.heappop(queue)
             result.append(job)
 
             # Process jobs that depend on current job
-            for dependent_job, deps in dependencies.items():
-                if job in deps:
-                    in_degree[dependent_job] -= 1
-                    if in_degree[dependent_job] == 0:
-                        queue.append(dependent_job)
+            for dependent_job in dependents.get(job, ()):
+                in_degree[dependent_job] -= 1
+                if in_degree[dependent_job] == 0:
+                    heapq.heappush(queue, dependent_job)
 
         # Add any remaining jobs (in case of cycles, fallback to alphabetical)
         remaining = set(dependencies.keys()) - set(result)
@@ -375,24 +415,33 @@ class WorkflowAnalyzer:
 
         return result
 
+    def get_job_order(self, workflow_file: str) -> Dict[str, int]:
+        """Get each job's position in dependency order, computed once per workflow."""
+        job_order = self._job_order_cache.get(workflow_file)
+        if job_order is None:
+            dependencies = self.get_job_dependencies(self.workflows[workflow_file])
+            sorted_jobs = self.topological_sort_jobs(dependencies)
+            job_order = {job: i for i, job in enumerate(sorted_jobs)}
+            self._job_order_cache[workflow_file] = job_order
+        return job_order
+
     def get_step_order(self, workflow_file: str, job_name: str) -> Dict[str, int]:
         """Get step execution order within a job."""
-        if workflow_file not in self.workflows:
-            return {}
-
-        workflow = self.workflows[workflow_file]
-        jobs = workflow.get('jobs', {})
-
-        if job_name not in jobs:
-            return {}
+        key = (workflow_file, job_name)
+        if key in self._step_order_cache:
+            return self._step_order_cache[key]
 
-        steps = jobs[job_name].get('steps', [])
         step_order = {}
+        workflow = self.workflows.get(workflow_file)
+        if workflow is not None:
+            jobs = workflow.get('jobs', {})
+            if job_name in jobs:
+                steps = jobs[job_name].get('steps', [])
+                for i, step in enumerate(steps):
+                    step_name = step.get('name', 'Unnamed step')
+                    step_order[step_name] = i
 
-        for i, step in enumerate(steps):
-            step_name = step.get('name', 'Unnamed step')
-            step_order[step_name] = i
-
+        self._step_order_cache[key] = step_order
         return step_order
 
     def create_execution_order_key(self, execution: StepExecution) -> Tuple:
@@ -403,12 +452,7 @@ class WorkflowAnalyzer:
         # Get job dependencies if available
         job_order = 0
         if workflow_base in self.workflows:
-            dependencies = self.get_job_dependencies(self.workflows[workflow_base])
-            sorted_jobs = self.topological_sort_jobs(dependencies)
-            try:
-                job_order = sorted_jobs.index(execution.job_name)
-            except ValueError:
-                job_order = 999  # Put unknown jobs at end
+            job_order = self.get_job_order(workflow_base).get(execution.job_name, 999)  # Put unknown jobs at end
 
         # Get step order within job
         step_order = 0
@@ -416,18 +460,7 @@ class WorkflowAnalyzer:
         if execution.step_name in step_orders:
             step_order = step_orders[execution.step_name]
 
-        # Event type ordering (some events are more common/important)
-        event_priority = {
-            EventType.PUSH_MASTER: 0,
-            EventType.PULL_REQUEST: 1,
-            EventType.MERGE_GROUP: 2,
-            EventType.RELEASE: 3,
-            EventType.WORKFLOW_DISPATCH_BOTH: 4,
-            EventType.WORKFLOW_DISPATCH_AMD64_ONLY: 5,
-            EventType.WORKFLOW_DISPATCH_ARM64_ONLY: 6,
-        }
-
-        event_order = event_priority.get(execution.event, 999)
+        event_order = _EVENT_PRIORITY.get(execution.event, 999)
 
         # Platform ordering (amd64 before arm64)
         platform_order = 0 if execution.amd64 else 1
@@ -440,9 +473,12 @@ class WorkflowAnalyzer:
             platform_order          # Platform order
         )
 
-    def generate_truth_table(self) -> str:
-        """Generate the markdown truth table with deduplication and execution ordering."""
-        lines = [
+    def generate_truth_table(self) -> Iterator[str]:
+        """Generate the markdown truth table with deduplication and execution ordering.
+
+        Yields one newline-terminated line at a time, so the table is never held as one string.
+        """
+        header = [
             "# GitHub Actions Workflow Execution Truth Table",
             "",
             "This table shows which steps execute on which platforms for different trigger events.",
@@ -460,22 +496,33 @@ class WorkflowAnalyzer:
             "| Workflow File | Workflow Name | Job | Step | Event | amd64 | arm64 | Condition |",
             "|---|---|---|---|---|---|---|---|"
         ]
+        for line in header:
+            yield line + "\n"
 
         # First, group executions by everything except daemon to combine daemon variants
         daemon_grouped = {}
+        # Every step of a matrix combination shares its matrix_values dict, so split each
+        # dict once; keyed by id(), which is stable while step_executions holds the dicts
+        matrix_splits = {}
         for execution in self.step_executions:
-            matrix_without_daemon = {}
-            daemon_values = []
-
-            if execution.matrix_values:
-                for k, v in execution.matrix_values.items():
-                    if k == 'daemon':
-                        if isinstance(v, dict) and 'name' in v:
-                            daemon_values.append(v['name'])
+            split = matrix_splits.get(id(execution.matrix_values))
+            if split is None:
+                matrix_without_daemon = {}
+                daemon_values = []
+
+                if execution.matrix_values:
+                    for k, v in execution.matrix_values.items():
+                        if k == 'daemon':
+                            if isinstance(v, dict) and 'name' in v:
+                                daemon_values.append(v['name'])
+                            else:
+                                daemon_values.append(str(v))
                         else:
-                            daemon_values.append(str(v))
-                    else:
-                        matrix_without_daemon[k] = v
+                            matrix_without_daemon[k] = v
+
+                split = (matrix_without_daemon, daemon_values, tuple(sorted(matrix_without_daemon.items())))
+                matrix_splits[id(execution.matrix_values)] = split
+            matrix_without_daemon, daemon_values, matrix_key = split
 
             group_key = (
                 execution.workflow_file,
@@ -484,7 +531,7 @@ class WorkflowAnalyzer:
                 execution.step_name,
                 execution.event.value,
                 execution.condition,
-                tuple(sorted(matrix_without_daemon.items()))
+                matrix_key
             )
 
             if group_key not in daemon_grouped:
@@ -493,7 +540,8 @@ class WorkflowAnalyzer:
                     'amd64': execution.amd64,
                     'arm64': execution.arm64,
                     'daemons': set(),
-                    'matrix_without_daemon': matrix_without_daemon
+                    'matrix_without_daemon': matrix_without_daemon,
+                    'matrix_key': matrix_key
                 }
             else:
                 daemon_grouped[group_key]['amd64'] = daemon_grouped[group_key]['amd64'] or execution.amd64
@@ -501,57 +549,11 @@ class WorkflowAnalyzer:
 
             daemon_grouped[group_key]['daemons'].update(daemon_values)
 
-        # Next, group by execution pattern (everything except event) to find duplicates
-        pattern_groups = defaultdict(list)
-        for group_key, group_data in daemon_grouped.items():
-            execution = group_data['execution']
-
-            # Create pattern key (everything except event)
-            pattern_key = (
-                execution.workflow_file,
-                execution.workflow_name,
-                execution.job_name,
-                execution.step_name,
-                group_data['amd64'],
-                group_data['arm64'],
-                execution.condition,
-                tuple(sorted(group_data['matrix_without_daemon'].items())),
-                tuple(sorted(group_data['daemons']))
-            )
-
-            pattern_groups[pattern_key].append((group_key, group_data))
-
-        # Create consolidated executions
-        consolidated = []
-        for pattern_key, pattern_instances in pattern_groups.items():
-            if len(pattern_instances) == 1:
-                # No duplication, keep as is
-                group_key, group_data = pattern_instances[0]
-                consolidated.append(group_data)
-            else:
-                # Multiple events with same pattern - consolidate
-                events = [instance['execution'].event for _, instance in pattern_instances]
-                events.sort(key=lambda e: e.value)
-
-                # Use first instance as base, but update event list
-                _, base_data = pattern_instances[0]
-                consolidated_data = base_data.copy()
-
-                # Create consolidated event string
-                event_names = [e.value for e in events]
-                if len(event_names) > 3:
-                    consolidated_data['event_str'] = f"{event_names[0]}, ... (+{len(event_names)-1} more)"
-                else:
-                    consolidated_data['event_str'] = ", ".join(event_names)
-
-                consolidated.append(consolidated_data)
-
-        # Sort by execution order
-        consolidated.sort(key=lambda x: self.create_execution_order_key(x['execution']))
-
-        # Final step: Platform coalescing with OR logic
-        platform_groups = defaultdict(list)
-        for group_data in consolidated:
+        # Then, in one pass, merge groups that differ only in event or platform:
+        # architectures are OR-ed and the events collected for the event column
+        merged = {}
+        pattern_count = 0
+        for group_data in daemon_grouped.values():
             execution = group_data['execution']
 
             # Create platform-agnostic key (remove platform from matrix)
@@ -559,8 +561,9 @@ class WorkflowAnalyzer:
             for k, v in group_data['matrix_without_daemon'].items():
                 if k != 'platform':
                     matrix_without_platform[k] = v
+            daemons = tuple(sorted(group_data['daemons']))  # Sorted once; reused by the key and the output
 
-            # Group by everything except platform and architecture execution
+            # Group by everything except event, platform and architecture execution
             platform_key = (
                 execution.workflow_file,
                 execution.workflow_name,
@@ -568,80 +571,59 @@ class WorkflowAnalyzer:
                 execution.step_name,
                 execution.condition,
                 tuple(sorted(matrix_without_platform.items())),
-                tuple(sorted(group_data['daemons']))
+                daemons
             )
 
-            platform_groups[platform_key].append(group_data)
+            row = merged.get(platform_key)
+            if row is None:
+                row = merged[platform_key] = {
+                    'amd64': False,
+                    'arm64': False,
+                    'daemons': daemons,
+                    'matrix_without_daemon': matrix_without_platform,
+                    'events': set(),
+                    'variants': {}
+                }
+            row['amd64'] = row['amd64'] or group_data['amd64']
+            row['arm64'] = row['arm64'] or group_data['arm64']
+            row['events'].add(execution.event.value)
+
+            # The first execution seen for each architecture/platform variant can stand in for
+            # the row when ordering; the count keeps ties in first-seen order
+            variant_key = (group_data['amd64'], group_data['arm64'], group_data['matrix_key'])
+            if variant_key not in row['variants']:
+                row['variants'][variant_key] = (pattern_count, execution)
+                pattern_count += 1
 
-        # Consolidate platform groups with OR logic
         final_consolidated = []
-        for platform_key, platform_instances in platform_groups.items():
-            if len(platform_instances) == 1:
-                # No platform variants, keep as is but remove platform from matrix
-                group_data = platform_instances[0].copy()
-                # Remove platform from matrix_without_daemon
-                matrix_without_platform = {}
-                for k, v in group_data['matrix_without_daemon'].items():
-                    if k != 'platform':
-                        matrix_without_platform[k] = v
-                group_data['matrix_without_daemon'] = matrix_without_platform
-                final_consolidated.append(group_data)
-            else:
-                # Multiple platform variants - apply OR logic
-                base_data = platform_instances[0].copy()
-
-                # OR logic for architectures
-                combined_amd64 = any(instance['amd64'] for instance in platform_instances)
-                combined_arm64 = any(instance['arm64'] for instance in platform_instances)
-
-                # Combine all events from all platform variants
-                all_events = set()
-                for instance in platform_instances:
-                    if 'event_str' in instance:
-                        # Parse consolidated event string
-                        event_str = instance['event_str']
-                        if ', ... (+' in event_str:
-                            # Extract first event and approximate count
-                            first_event = event_str.split(',')[0]
-                            all_events.add(first_event)
-                            # For now, we'll mark this as having more events
-                            # In a real implementation, we'd track all events properly
-                        else:
-                            # Simple comma-separated events
-                            events = [e.strip() for e in event_str.split(',')]
-                            all_events.update(events)
-                    else:
-                        all_events.add(instance['execution'].event.value)
-
-                # Remove platform from matrix
-                matrix_without_platform = {}
-                for k, v in base_data['matrix_without_daemon'].items():
-                    if k != 'platform':
-                        matrix_without_platform[k] = v
-
-                # Create consolidated platform group
-                consolidated_platform_data = {
-                    'execution': base_data['execution'],
-                    'amd64': combined_amd64,
-                    'arm64': combined_arm64,
-                    'daemons': base_data['daemons'],
-                    'matrix_without_daemon': matrix_without_platform
-                }
+        for row in merged.values():
+            # The variant that sorts first represents the row
+            order, execution = min(
+                ((self.create_execution_order_key(execution), index), execution)
+                for index, execution in row['variants'].values()
+            )
 
-                # Create consolidated event string
-                sorted_events = sorted(list(all_events))
-                if len(sorted_events) > 3:
-                    consolidated_platform_data['event_str'] = f"{sorted_events[0]}, ... (+{len(sorted_events)-1} more)"
-                else:
-                    consolidated_platform_data['event_str'] = ", ".join(sorted_events)
+            # Create consolidated event string
+            sorted_events = sorted(row['events'])
+            if len(sorted_events) > 3:
+                event_str = f"{sorted_events[0]}, ... (+{len(sorted_events)-1} more)"
+            else:
+                event_str = ", ".join(sorted_events)
 
-                final_consolidated.append(consolidated_platform_data)
+            final_consolidated.append((order, {
+                'execution': execution,
+                'amd64': row['amd64'],
+                'arm64': row['arm64'],
+                'daemons': row['daemons'],
+                'matrix_without_daemon': row['matrix_without_daemon'],
+                'event_str': event_str
+            }))
 
         # Sort final results by execution order
-        final_consolidated.sort(key=lambda x: self.create_execution_order_key(x['execution']))
+        final_consolidated.sort(key=lambda x: x[0])
 
         # Generate output lines
-        for group_data in final_consolidated:
+        for _, group_data in final_consolidated:
             execution = group_data['execution']
 
             # Build matrix string
@@ -653,23 +635,20 @@ class WorkflowAnalyzer:
                     matrix_items.append(f"{k}={v}")
 
             if group_data['daemons']:
-                daemon_list = sorted(list(group_data['daemons']))
-                matrix_items.append(f"daemon={','.join(daemon_list)}")
+                matrix_items.append(f"daemon={','.join(group_data['daemons'])}")
 
             matrix_str = ", ".join(matrix_items)
 
             amd64_symbol = "✅" if group_data['amd64'] else "❌"
             arm64_symbol = "✅" if group_data['arm64'] else "❌"
 
-            condition_str = execution.condition[:50] + "..." if len(execution.condition) > 50 else execution.condition
-
-            # Use consolidated event string if available
-            event_str = group_data.get('event_str', execution.event.value)
+            condition_str = _condition_cell(execution.condition)
 
-            line = f"| `{execution.workflow_file}` | {execution.workflow_name} | `{execution.job_name}` | {execution.step_name} | `{event_str}` | {amd64_symbol} | {arm64_symbol} | {condition_str} |"
-            lines.append(line)
+            # Every row carries the events it was merged from
+            event_str = group_data['event_str']
 
-        return "\n".join(lines)
+            line = f"| `{execution.workflow_file}` | {execution.workflow_name} | `{execution.job_name}` | {execution.step_name} | `{event_str}` | {amd64_symbol} | {arm64_symbol} | {condition_str} |\n"
+            yield line
 
     def run(self):
         """Main execution method."""
@@ -677,18 +656,39 @@ class WorkflowAnalyzer:
 
         for filename, workflow in self.workflows.items():
             print(f"Analyzing {filename}:")
-            events = self.get_workflow_events(workflow)
+            events = self.get_events_for_workflow(filename, workflow)
             print(f"  Events: {[e.value for e in events]}")
             self.analyze_workflow(filename, workflow)
 
-        truth_table = self.generate_truth_table()
-
-        with open('ACTIONS.md', 'w') as f:
-            f.write(truth_table)
+        write_atomically('ACTIONS.md', self.generate_truth_table())
 
         print(f"Generated truth table with {len(self.step_executions)} step executions")
         print("Output written to ACTIONS.md")
 
+def write_atomically(path: str, chunks: Iterable[str]):
+    """Write chunks to path through a temp file in the same directory.
+
+    The temp file replaces path only once everything is written, so an error
+    partway through leaves the previous file untouched.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(chunks)
+        # mkstemp creates the file 0600; keep the mode a plain open() would have given it
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 if __name__ == "__main__":
     analyzer = WorkflowAnalyzer()
     analyzer.run()
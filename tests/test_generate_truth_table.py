@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import generate_truth_table
+
+class TestGenerateTruthTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'TESTS.md')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_write_atomically_replaces_file(self):
+        with open(self.path, 'w') as f:
+            f.write("old\n")
+        generate_truth_table.write_atomically(self.path, ["new\n", "rows\n"])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "new\nrows\n")
+        self.assertEqual(os.listdir(self.tmpdir.name), ['TESTS.md']) # No temp file left behind
+
+    def test_write_atomically_keeps_old_file_on_error(self):
+        with open(self.path, 'w') as f:
+            f.write("old\n")
+
+        def rows():
+            yield "partial\n"
+            raise RuntimeError("Generation failed")
+
+        with self.assertRaises(RuntimeError):
+            generate_truth_table.write_atomically(self.path, rows())
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "old\n")
+        self.assertEqual(os.listdir(self.tmpdir.name), ['TESTS.md'])
+
+    def _parse(self, text):
+        path = os.path.join(self.tmpdir.name, 'workflow.yml')
+        with open(path, 'w') as f:
+            f.write(text)
+        return generate_truth_table.parse_workflow(path)
+
+    def test_parse_workflow_accepts_quoted_jobs_key(self):
+        for key in ('"jobs"', "'jobs'"):
+            workflow = self._parse(
+                "on: push\n"
+                f"{key}:\n"
+                "  build:\n"
+                "    steps:\n"
+                "      - name: Checkout\n"
+            )
+            self.assertEqual(workflow['jobs']['build']['steps'], [{'name': 'Checkout'}], key)
+
+    def test_parse_workflow_accepts_flow_style(self):
+        workflow = self._parse('{"on": "push", "jobs": {"build": {"steps": [{"name": "Checkout"}]}}}\n')
+        self.assertIn('build', workflow['jobs'])
+
+    def test_parse_workflow_skips_file_without_jobs(self):
+        self.assertIsNone(self._parse("name: Shared settings\nenv:\n  FOO: bar\n"))
+
+    def test_quoted_jobs_key_produces_rows(self):
+        path = os.path.join(self.tmpdir.name, 'quoted.yml')
+        with open(path, 'w') as f:
+            f.write("on: push\n\"jobs\":\n  build:\n    steps:\n      - name: Checkout\n")
+        rows = list(generate_truth_table.generate_truth_table([path]))
+        self.assertTrue(any("`quoted.yml` | `build` | `Checkout`" in row for row in rows))
+
+if __name__ == '__main__':
+    unittest.main()